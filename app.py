@@ -2,13 +2,17 @@ import sys
 import os
 from src.GLOBAL import GLOBAL
 sys.path.append(os.path.join(GLOBAL.instant_ngp, 'build'))
-from flask import Flask
-from views import *
 
 
-app = Flask(__name__, static_url_path='', static_folder='./src/static', template_folder='./src/templates')
-app.register_blueprint(core_bp)
+def create_app():
+    # Preprocessing workers import this module again as __mp_main__, views builds the job queue, caches and admission
+    # control on import, so it is only imported by the server
+    from flask import Flask
+    from views import core_bp
+    app = Flask(__name__, static_url_path='', static_folder='./src/static', template_folder='./src/templates')
+    app.register_blueprint(core_bp)
+    return app
 
-if __name__ == '__main__':
-    app.run(debug=True, host=GLOBAL.host, port=GLOBAL.port)
 
+if __name__ == '__main__':
+    create_app().run(debug=True, host=GLOBAL.host, port=GLOBAL.port)
@@ -0,0 +1,62 @@
+"""
+Compares running wizards on one image at a time with running them on an (N, H, W, C) stack.
+
+    python -m benchmarks.batching --batch 32 --size 1920 1080 --runs 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import preprocessing_wizards as wizards
+from preprocessing_wizards import PPWizard
+
+PIPELINES = {'white_balancing': lambda: [wizards.WhiteBalancing(percentile=98)],
+             'resizing': lambda: [wizards.Resizing(high=1280, low=720)],
+             'filtering': lambda: [wizards.Filtering()],
+             'resizing+white_balancing': lambda: [wizards.Resizing(high=1280, low=720),
+                                                  wizards.WhiteBalancing(percentile=98)]}
+
+
+def per_image(batch, pipeline):
+    return np.stack([PPWizard.run_pipeline(img, pipeline)[0] for img in batch])
+
+
+def batched(batch, pipeline):
+    return PPWizard.run_pipeline_batch(batch, pipeline)
+
+
+def best_of(runs, fn, *args):
+    best = float('inf')
+    for _ in range(runs):
+        tic = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', default=32, type=int)
+    parser.add_argument('--size', default=[1920, 1080], type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--runs', default=5, type=int)
+    parser.add_argument('--pipeline', default=list(PIPELINES), nargs='*', choices=list(PIPELINES))
+    args = parser.parse_args()
+
+    width, height = args.size
+    batch = np.random.default_rng(0).integers(0, 256, (args.batch, height, width, 3), dtype=np.uint8)
+    for name in args.pipeline:
+        pipeline = PIPELINES[name]()
+        single_seconds, expected = best_of(args.runs, per_image, batch, pipeline)
+        batch_seconds, result = best_of(args.runs, batched, batch, pipeline)
+        print(f'{name}: per image {single_seconds * 1000:0.1f}ms, batched {batch_seconds * 1000:0.1f}ms, '
+              f'speedup {single_seconds / batch_seconds:0.2f}x, identical {np.array_equal(expected, result)}')
+
+
+if __name__ == '__main__':
+    main()
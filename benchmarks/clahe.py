@@ -0,0 +1,69 @@
+"""
+Measures CLAHE per mode, how much of it the color conversion costs, and what reusing the OpenCV object saves over
+creating one per image, also when every image gets its own unpickled wizard like in the worker processes.
+
+    python -m benchmarks.clahe --images 20 --size 4000 3000 --runs 3
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from preprocessing_wizards.clahe import CLAHE, COLOR_SPACES
+
+
+def best_of(runs, fn):
+    best = float('inf')
+    for _ in range(runs):
+        tic = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=20, type=int)
+    parser.add_argument('--size', default=[4000, 3000], type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--runs', default=3, type=int)
+    args = parser.parse_args()
+
+    width, height = args.size
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    images = [img] * args.images
+
+    def per_image(seconds):
+        return f'{seconds * 1000 / args.images:0.1f}ms/image'
+
+    for mode in ('gray', 'lab', 'ycrcb'):
+        wizard = CLAHE(2.0, (8, 8), mode=mode)
+        total = best_of(args.runs, lambda: wizard.preprocess(images))
+        line = f'{mode}: {per_image(total)}'
+        if mode in COLOR_SPACES:
+            forward, backward, _ = COLOR_SPACES[mode]
+            conversion = best_of(args.runs, lambda: [cv2.cvtColor(cv2.cvtColor(i, forward), backward) for i in images])
+            line += f', of which color conversion {per_image(conversion)} ({conversion / total:0.0%})'
+        print(line)
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    reused = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    created = best_of(args.runs, lambda: [cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+                                          for _ in images])
+    shared = best_of(args.runs, lambda: [reused.apply(gray) for _ in images])
+    print(f'apply on the luminance only: new object per image {per_image(created)}, reused object {per_image(shared)}')
+
+    data = pickle.dumps(CLAHE(2.0, (8, 8), mode='gray'))
+    unpickled = best_of(args.runs, lambda: [pickle.loads(data).clahe.apply(gray) for _ in images])
+    print(f'apply with a wizard unpickled per image: {per_image(unpickled)}')
+
+
+if __name__ == '__main__':
+    main()
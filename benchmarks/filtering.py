@@ -0,0 +1,70 @@
+"""
+Compares the approximate Filtering mode at several qualities with the exact bilateral filter, reporting the speedup
+and the PSNR of the approximation against the exact output.
+
+    python -m benchmarks.filtering --size 2773 1560 --qualities 1 0.5 0.25 0.125 --runs 3
+    python -m benchmarks.filtering --image photo.jpg
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from preprocessing_wizards.filter import Filtering
+
+
+def synthetic_image(width, height):
+    """
+    Flat colored shapes with hard edges and sensor like noise, the content an edge preserving filter is made for
+    """
+    rng = np.random.default_rng(0)
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    for _ in range(60):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(20, max(21, min(width, height) // 5))), color, -1)
+    img = cv2.GaussianBlur(img, (0, 0), 1.5)
+    return np.clip(img + rng.normal(0, 12, img.shape), 0, 255).astype(np.uint8)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def best_of(runs, fn):
+    best = float('inf')
+    for _ in range(runs):
+        tic = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default=None, help='Benchmark on this image instead of a synthetic one')
+    parser.add_argument('--size', default=[2773, 1560], type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--qualities', default=[1.0, 0.5, 0.25, 0.125], type=float, nargs='+')
+    parser.add_argument('--runs', default=3, type=int)
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image) if args.image else synthetic_image(*args.size)
+    exact = Filtering()
+    exact_seconds, expected = best_of(args.runs, lambda: exact.preprocess([img])[0])
+    print(f'exact: {exact_seconds * 1000:0.1f}ms')
+    for quality in args.qualities:
+        wizard = Filtering(mode='approximate', quality=quality)
+        seconds, result = best_of(args.runs, lambda: wizard.preprocess([img])[0])
+        print(f'approximate quality {quality}: {seconds * 1000:0.1f}ms, speedup {exact_seconds / seconds:0.1f}x, '
+              f'PSNR {psnr(result, expected):0.2f}dB')
+
+
+if __name__ == '__main__':
+    main()
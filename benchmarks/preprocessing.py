@@ -0,0 +1,80 @@
+"""
+Compares preprocessing a folder of synthetic images one after another with the PreprocessingExecutor.
+
+    python -m benchmarks.preprocessing --images 100 1000 --size 1920 1080 --workers 8 --pipeline filtering
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import preprocessing_wizards as wizards
+from preprocessing_wizards.executor import PreprocessingExecutor, preprocess_file
+
+WIZARDS = {'clahe': lambda: wizards.CLAHE(2.0, (8, 8)),
+           'filtering': lambda: wizards.Filtering(),
+           'white_balancing': lambda: wizards.WhiteBalancing()}
+
+
+def make_images(folder, count, width, height):
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 5)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'{i:05d}.jpg')
+        cv2.imwrite(path, np.roll(base, i, axis=1))
+        paths.append(path)
+    return paths
+
+
+def sequential(paths, pipeline):
+    for path in paths:
+        preprocess_file(path, pipeline)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=[100, 1000], type=int, nargs='+')
+    parser.add_argument('--size', default=[1920, 1080], type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--workers', default=None, type=int)
+    parser.add_argument('--in_flight', default=None, type=int)
+    parser.add_argument('--pipeline', default=['filtering'], nargs='*', choices=list(WIZARDS))
+    args = parser.parse_args()
+
+    pipeline = [wizards.Resizing(high=2773, low=1560)] + [WIZARDS[name]() for name in args.pipeline]
+    executor = PreprocessingExecutor(args.workers, args.in_flight)
+    for count in args.images:
+        source = tempfile.mkdtemp()
+        work = tempfile.mkdtemp()
+        try:
+            make_images(source, count, *args.size)
+            for name, run in (('sequential', sequential),
+                              (f'executor ({executor.workers} workers, {executor.max_in_flight} in flight)',
+                               lambda paths, pipeline: executor.map(paths, pipeline))):
+                shutil.rmtree(work)
+                shutil.copytree(source, work)
+                paths = [os.path.join(work, name) for name in sorted(os.listdir(work))]
+                tic = time.perf_counter()
+                run(paths, pipeline)
+                seconds = time.perf_counter() - tic
+                print(f'{count} images, {name}: {seconds:0.2f}s, {count / seconds:0.1f} images/s')
+        finally:
+            shutil.rmtree(source, ignore_errors=True)
+            shutil.rmtree(work, ignore_errors=True)
+    executor.shutdown()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f'max rss: {rss:0.1f}MB, largest worker: {children:0.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures decode + resize time per source megapixel of Resizing with a full decode and linear interpolation against
+the reduced JPEG decode with area interpolation.
+
+    python -m benchmarks.resizing --sizes 8000x6000 4000x3000 1920x1080 --target 2773 1560 --runs 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from preprocessing_wizards.resize import Resizing
+
+
+def full_decode(data, wizard):
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    return cv2.resize(img, wizard.target_size(img.shape))
+
+
+def reduced_decode(data, wizard):
+    return wizard.preprocess([wizard.decode(data)])[0]
+
+
+def best_of(runs, fn, *args):
+    best = float('inf')
+    for _ in range(runs):
+        tic = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=['8000x6000', '4000x3000', '1920x1080'], nargs='+')
+    parser.add_argument('--target', default=[2773, 1560], type=int, nargs=2, metavar=('HIGH', 'LOW'))
+    parser.add_argument('--runs', default=5, type=int)
+    args = parser.parse_args()
+
+    wizard = Resizing(*args.target)
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        width, height = map(int, size.split('x'))
+        img = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+        data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1]
+        megapixels = width * height / 1e6
+        full_seconds, expected = best_of(args.runs, full_decode, data, wizard)
+        reduced_seconds, result = best_of(args.runs, reduced_decode, data, wizard)
+        difference = np.abs(expected.astype(np.int16) - result.astype(np.int16)).mean()
+        print(f'{size} ({megapixels:0.1f}MP): full decode {full_seconds * 1000 / megapixels:0.2f}ms/MP, '
+              f'reduced decode {reduced_seconds * 1000 / megapixels:0.2f}ms/MP, '
+              f'speedup {full_seconds / reduced_seconds:0.2f}x, mean abs difference {difference:0.2f}')
+
+
+if __name__ == '__main__':
+    main()
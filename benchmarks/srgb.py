@@ -0,0 +1,105 @@
+"""
+Compares the lookup table sRGB conversions of model.common with srgb_to_linear and linear_to_srgb on the read and write
+paths of read_image and write_image, reporting the speedup and the largest difference of the results.
+
+    python -m benchmarks.srgb --size 2773 1560 --runs 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from model.common import linear_to_srgb, linear_to_srgb_lut, premultiply, srgb_to_linear, srgb_to_linear_lut, \
+    unmultiply
+
+
+def best_of(runs, fn):
+    best = float('inf')
+    for _ in range(runs):
+        tic = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def read_functions(raw):
+    img = raw.astype(np.float32) / np.iinfo(raw.dtype).max
+    img[..., 0:3] = srgb_to_linear(img[..., 0:3])
+    img[..., 0:3] *= img[..., 3:4]
+    return img
+
+
+def read_lut(raw, out):
+    srgb_to_linear_lut(raw, out=out)
+    out[..., 3] = raw[..., 3]
+    out[..., 3] /= np.iinfo(raw.dtype).max
+    return premultiply(out)
+
+
+def write_functions(img):
+    img = np.copy(img)
+    img[..., 0:3] = np.divide(img[..., 0:3], img[..., 3:4], out=np.zeros_like(img[..., 0:3]), where=img[..., 3:4] != 0)
+    img[..., 0:3] = linear_to_srgb(img[..., 0:3])
+    return (np.clip(img, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def write_lut(img, scratch, out):
+    np.copyto(scratch, img)
+    unmultiply(scratch)
+    linear_to_srgb_lut(scratch, out=out)
+    out[..., 3] = np.clip(scratch[..., 3], 0.0, 1.0) * 255.0 + 0.5
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default=[2773, 1560], type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--runs', default=5, type=int)
+    args = parser.parse_args()
+
+    width, height = args.size
+    megapixels = width * height / 1e6
+    rng = np.random.default_rng(0)
+    raw = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+    def report(name, reference, lut):
+        (reference_seconds, expected), (lut_seconds, result) = reference, lut
+        difference = np.abs(expected.astype(np.float64) - result).max()
+        print(f'{name}: functions {reference_seconds * 1000 / megapixels:0.2f}ms/MP, '
+              f'lookup table {lut_seconds * 1000 / megapixels:0.2f}ms/MP, '
+              f'speedup {reference_seconds / lut_seconds:0.1f}x, max abs difference {difference:g}')
+
+    out = np.empty(raw.shape, dtype=np.float32)
+    report('8 bit sRGB to linear', best_of(args.runs, lambda: read_functions(raw)),
+           best_of(args.runs, lambda: read_lut(raw, out)))
+
+    raw16 = rng.integers(0, 65536, (height, width, 4), dtype=np.uint16)
+    report('16 bit sRGB to linear', best_of(args.runs, lambda: read_functions(raw16)),
+           best_of(args.runs, lambda: read_lut(raw16, out)))
+
+    half = rng.random((height, width, 3), dtype=np.float32).astype(np.float16)
+    srgb = np.empty(half.shape, dtype=np.float32)
+    report('float16 sRGB to linear', best_of(args.runs, lambda: srgb_to_linear(half.astype(np.float32))),
+           best_of(args.runs, lambda: srgb_to_linear_lut(half, out=srgb)))
+    report('float16 linear to sRGB', best_of(args.runs, lambda: linear_to_srgb(half.astype(np.float32))),
+           best_of(args.runs, lambda: linear_to_srgb_lut(half, out=srgb)))
+
+    # Arbitrary premultiplied renders rather than 8 bit values converted back, including values outside [0, 1] and
+    # pixels without alpha
+    linear = rng.uniform(-0.05, 1.05, (height, width, 4)).astype(np.float32)
+    linear[..., 3] = np.clip(linear[..., 3], 0.0, 1.0)
+    linear[..., 3][rng.random((height, width)) < 0.05] = 0.0
+    linear[..., 0:3] *= linear[..., 3:4]
+    scratch = np.empty(linear.shape, dtype=np.float32)
+    encoded = np.empty(linear.shape, dtype=np.uint8)
+    report('linear to 8 bit sRGB', best_of(args.runs, lambda: write_functions(linear)),
+           best_of(args.runs, lambda: write_lut(linear, scratch, encoded)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures how long importing the server takes and how much memory it uses, then how long the first use of every
+preprocessing wizard and pose estimator takes.
+
+    python -m benchmarks.startup --instant_ngp <path to instant-ngp> --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+sys.argv = ['app.py', '--instant_ngp', {instant_ngp!r}]
+sys.path.insert(0, {root!r})
+tic = time.perf_counter()
+import {module}
+toc = time.perf_counter()
+loaded = sorted(m for m in ('tensorflow', 'keras', 'torch', 'torchvision', 'hloc', 'pyngp') if m in sys.modules)
+print(json.dumps({{'seconds': toc - tic, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy_modules': loaded}}))
+"""
+
+FIRST_USE_SCRIPT = """
+import json, sys, time
+sys.argv = ['app.py', '--instant_ngp', {instant_ngp!r}]
+sys.path.insert(0, {root!r})
+import logic
+registry = getattr(logic, {registry!r})
+tic = time.perf_counter()
+try:
+    registry[{name!r}]
+    error = None
+except Exception as e:
+    error = repr(e)
+print(json.dumps({{'seconds': time.perf_counter() - tic, 'error': error}}))
+"""
+
+
+def run(script):
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True, cwd=ROOT_DIR)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instant_ngp', default=ROOT_DIR)
+    parser.add_argument('--module', default='views', help='Module whose import is measured')
+    parser.add_argument('--runs', default=5, type=int)
+    args = parser.parse_args()
+
+    results = [run(STARTUP_SCRIPT.format(instant_ngp=args.instant_ngp, root=ROOT_DIR, module=args.module))
+               for _ in range(args.runs)]
+    seconds = sorted(r['seconds'] for r in results)
+    print(f"import {args.module}: median {seconds[len(seconds) // 2]:0.3f}s, min {seconds[0]:0.3f}s, "
+          f"max rss {max(r['max_rss_mb'] for r in results):0.1f}MB, heavy modules loaded: {results[0]['heavy_modules']}")
+
+    sys.argv = ['app.py', '--instant_ngp', args.instant_ngp]
+    sys.path.insert(0, ROOT_DIR)
+    import logic
+    for registry in ('preprocessing_wizards', 'poseEstimators'):
+        for name in getattr(logic, registry):
+            result = run(FIRST_USE_SCRIPT.format(instant_ngp=args.instant_ngp, root=ROOT_DIR, registry=registry,
+                                                 name=name))
+            status = f"failed: {result['error']}" if result['error'] else 'ok'
+            print(f"first use of {registry}[{name!r}]: {result['seconds']:0.3f}s ({status})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,20 @@
-from .colmap import *
-from .hloc_model import *
\ No newline at end of file
+import importlib
+
+# hloc imports torch, so the estimators are only imported on first access
+_MODULES = {'ColmapMatchers': '.colmap',
+            'ColmapCameraModel': '.colmap',
+            'ColmapLocalizationPredictOptions': '.colmap',
+            'ColMapLocalization': '.colmap',
+            'HLOCPredictOptions': '.hloc_model',
+            'HLOCModel': '.hloc_model',
+            'FrameSelector': '.frame_selection'}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
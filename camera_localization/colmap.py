@@ -3,6 +3,7 @@ import shutil
 from enum import Enum
 from pathlib import Path
 from .common import *
+from .video import KeyframeExtractor
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 SCRIPTS_FOLDER = os.path.join(ROOT_DIR, "scripts")
@@ -32,7 +33,8 @@ class ColmapLocalizationPredictOptions:
                  run_colmap=True, colmap_matcher: ColmapMatchers = ColmapMatchers.exhaustive, colmap_db="colmap.db",
                  colmap_camera_model: ColmapCameraModel = ColmapCameraModel.OPENCV, colmap_camera_params="",
                  text="colmap_text", aabb_scale=32, skip_early=0, keep_colmap_coords=True,
-                 vocab_path="", mask_categories=[]):
+                 vocab_path="", mask_categories=[], video_mode="ffmpeg", image_store=None,
+                 keyframe_motion=0.05):
         """
         :param video_in: Run ffmpeg first to convert a provided video file into a set of images. Uses the video_fps parameter also.
         :param video_fps: Fps of input video
@@ -49,6 +51,9 @@ class ColmapLocalizationPredictOptions:
         :param keep_colmap_coords: Keep transforms.json in COLMAP's original frame of reference (this will avoid reorienting and repositioning the scene for preview and rendering).
         :param vocab_path: Vocabulary tree path.
         :param mask_categories: Object categories that should be masked out from the training images. See `scripts/category2id.json` for supported categories.
+        :param video_mode: "ffmpeg" extracts frames at video_fps, "stream" decodes the video in process and only writes keyframes selected by camera motion and sharpness.
+        :param keyframe_motion: Camera motion between keyframes in "stream" video_mode, as a fraction of the frame diagonal.
+        :param image_store: Optional ImageStore holding the decoded images, colmap2TransformsJson reads them from it instead of decoding the images again.
         """
 
         self.video_in = video_in
@@ -69,6 +74,9 @@ class ColmapLocalizationPredictOptions:
         self.vocab_path = vocab_path
         self.overwrite = True
         self.mask_categories = mask_categories
+        self.video_mode = video_mode
+        self.image_store = image_store
+        self.keyframe_motion = keyframe_motion
 
 
 class ColMapLocalization:
@@ -115,7 +123,17 @@ class ColMapLocalization:
         do_system(
             f"{ffmpeg_binary} -i {video} -qscale:v 1 -qmin 1 -vf \"fps={fps}{time_slice_value}\" {images}/%04d.jpg")
 
-    def run_colmap(self, args):
+    def extract_keyframes(self, args: ColmapLocalizationPredictOptions):
+        images = os.path.join(args.path, args.images_folder)
+        shutil.rmtree(images, ignore_errors=True)
+        os.makedirs(images)
+        count = 0
+        extractor = KeyframeExtractor(min_motion=args.keyframe_motion)
+        for count, (timestamp, frame) in enumerate(extractor.keyframes(args.video_in, args.time_slice), 1):
+            cv2.imwrite(os.path.join(images, f"{count:04d}.jpg"), frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        print(f"selected {count} keyframes from {args.video_in}")
+
+    def run_colmap(self, args, progress=None):
         colmap_binary = find_colmap()
 
         db = os.path.abspath(os.path.join(args.path, args.colmap_db))
@@ -134,36 +152,50 @@ class ColMapLocalization:
             sys.exit(1)
         if os.path.exists(db):
             os.remove(db)
-        do_system(
-            f"{colmap_binary} feature_extractor --ImageReader.camera_model {args.colmap_camera_model.name} --ImageReader.camera_params \"{args.colmap_camera_params}\" --SiftExtraction.estimate_affine_shape=true --SiftExtraction.domain_size_pooling=true --ImageReader.single_camera 1 --database_path {db} --image_path {images}")
+        with sfm_step(progress, 'feature_extractor'):
+            do_system(
+                f"{colmap_binary} feature_extractor --ImageReader.camera_model {args.colmap_camera_model.name} --ImageReader.camera_params \"{args.colmap_camera_params}\" --SiftExtraction.estimate_affine_shape=true --SiftExtraction.domain_size_pooling=true --ImageReader.single_camera 1 --database_path {db} --image_path {images}")
         match_cmd = f"{colmap_binary} {args.colmap_matcher.name}_matcher --SiftMatching.guided_matching=true --database_path {db}"
         if args.vocab_path:
             match_cmd += f" --VocabTreeMatching.vocab_tree_path {args.vocab_path}"
-        do_system(match_cmd)
+        with sfm_step(progress, f'{args.colmap_matcher.name}_matcher'):
+            do_system(match_cmd)
         try:
             shutil.rmtree(sparse)
         except:
             pass
         do_system(f"mkdir {sparse}")
-        do_system(f"{colmap_binary} mapper --database_path {db} --image_path {images} --output_path {sparse}")
-        do_system(
-            f"{colmap_binary} bundle_adjuster --input_path {sparse}/0 --output_path {sparse}/0 --BundleAdjustment.refine_principal_point 1")
+        with sfm_step(progress, 'mapper'):
+            do_system(f"{colmap_binary} mapper --database_path {db} --image_path {images} --output_path {sparse}")
+        with sfm_step(progress, 'bundle_adjuster'):
+            do_system(
+                f"{colmap_binary} bundle_adjuster --input_path {sparse}/0 --output_path {sparse}/0 --BundleAdjustment.refine_principal_point 1")
         try:
             shutil.rmtree(text)
         except:
             pass
         do_system(f"mkdir {text}")
-        do_system(
-            f"{colmap_binary} model_converter --input_path {sparse}/0 --output_path {text} --output_type TXT")
+        with sfm_step(progress, 'model_converter'):
+            do_system(
+                f"{colmap_binary} model_converter --input_path {sparse}/0 --output_path {text} --output_type TXT")
 
-    def predict(self, args: ColmapLocalizationPredictOptions):
-        if args.video_in is not None:
-            self.run_ffmpeg(args)
+    def predict(self, args: ColmapLocalizationPredictOptions, progress=None):
+        """
+        :param progress: Optional callable progress(event, **data) notified at the boundaries of every COLMAP step
+        """
+        if args.video_in is not None and args.video_mode == "stream":
+            with sfm_step(progress, 'keyframes'):
+                self.extract_keyframes(args)
+        elif args.video_in is not None:
+            with sfm_step(progress, 'ffmpeg'):
+                self.run_ffmpeg(args)
         if args.run_colmap:
-            self.run_colmap(args)
-        colmap2TransformsJson(aabb_scale=args.aabb_scale,
-                              skip_early=args.skip_early,
-                              path=args.path,
-                              images_folder=args.images_folder,
-                              text=args.text,
-                              output_path=args.output_path)
+            self.run_colmap(args, progress)
+        with sfm_step(progress, 'colmap2TransformsJson'):
+            colmap2TransformsJson(aabb_scale=args.aabb_scale,
+                                  skip_early=args.skip_early,
+                                  path=args.path,
+                                  images_folder=args.images_folder,
+                                  text=args.text,
+                                  output_path=args.output_path,
+                                  image_store=args.image_store)
@@ -6,8 +6,15 @@ import json
 import math
 import os
 import subprocess
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from glob import glob
 
+from src.metrics import REGISTRY
+
 
 def do_system(arg):
     print(f"==== running: {arg}")
@@ -17,6 +24,21 @@ def do_system(arg):
         sys.exit(err)
 
 
+@contextmanager
+def sfm_step(progress, step):
+    """
+    Reports the boundaries of a pose estimation step
+    :param progress: Optional callable progress(event, **data)
+    :param step: Name of the step, e.g. the COLMAP subcommand
+    """
+    if progress is not None:
+        progress('sfm', step=step, state='started')
+    with REGISTRY.timed('sfm_step', 'Duration of a pose estimation step', step=step):
+        yield
+    if progress is not None:
+        progress('sfm', step=step, state='finished')
+
+
 def find_colmap():
     ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     SCRIPTS_FOLDER = os.path.join(ROOT_DIR, "scripts")
@@ -56,7 +78,14 @@ def colmap2TransformsJson(aabb_scale,
                           text,
                           output_path,
                           mask_categories=[],
-                          keep_colmap_coords=False):
+                          keep_colmap_coords=False,
+                          sharpness_downsample=1,
+                          image_store=None):
+    """
+    :param sharpness_downsample: Decode the images at 1/2, 1/4 or 1/8 of their size to score their sharpness
+    :param image_store: Optional ImageStore holding the decoded images, sharpness and masks are computed on them
+    instead of decoding the images again
+    """
     AABB_SCALE = int(aabb_scale)
     SKIP_EARLY = int(skip_early)
     IMAGE_FOLDER = os.path.join(path, images_folder)
@@ -201,8 +230,6 @@ def colmap2TransformsJson(aabb_scale,
                 # why is this requireing a relitive path while using ^
                 image_rel = IMAGE_FOLDER
                 name = str(f"{image_rel}/{'_'.join(elems[9:])}")
-                b = sharpness(name)
-                print(name, "sharpness=", b)
                 image_id = int(elems[0])
                 qvec = np.array(tuple(map(float, elems[1:5])))
                 tvec = np.array(tuple(map(float, elems[5:8])))
@@ -218,11 +245,18 @@ def colmap2TransformsJson(aabb_scale,
 
                     up += c2w[0:3, 1]
 
-                frame = {"file_path": name, "sharpness": b, "transform_matrix": c2w}
+                # Sharpness is scored for all frames at once after the loop
+                frame = {"file_path": name, "sharpness": None, "transform_matrix": c2w}
                 if len(cameras) != 1:
                     frame.update(cameras[int(elems[8])])
                 out["frames"].append(frame)
     nframes = len(out["frames"])
+    measures = measure_images([f["file_path"] for f in out["frames"]], downsample=sharpness_downsample,
+                              store=image_store)
+    for f in out["frames"]:
+        measure = measures[f["file_path"]]
+        f["sharpness"] = measure[0] if measure is not None else 0
+        print(f["file_path"], "sharpness=", f["sharpness"])
 
     if keep_colmap_coords:
         flip_mat = np.array([
@@ -314,7 +348,9 @@ def colmap2TransformsJson(aabb_scale,
         predictor = DefaultPredictor(cfg)
 
         for frame in out["frames"]:
-            img = cv2.imread(frame["file_path"])
+            img = image_store.get(os.path.basename(frame["file_path"])) if image_store is not None else None
+            if img is None:
+                img = cv2.imread(frame["file_path"])
             outputs = predictor(img)
 
             output_mask = np.zeros((img.shape[0], img.shape[1]))
@@ -332,15 +368,105 @@ def variance_of_laplacian(image):
     return cv2.Laplacian(image, cv2.CV_64F).var()
 
 
+def dhash(gray):
+    """
+    Difference hash, neighbouring pixels of an 8 x 8 thumbnail compared left to right
+    :param gray: A grayscale image
+    :return: The hash as a 64 bit int
+    """
+    thumbnail = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+REDUCED_GRAYSCALE_FLAGS = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                           4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+class MeasureCache:
+    def __init__(self, max_entries=200000):
+        """
+        In memory LRU of image measures keyed by the content of the image file, so every stage that scores the same
+        image reuses the value instead of decoding it again
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+MEASURES = MeasureCache()
+
+
+def _grayscale(image, downsample):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else np.asarray(image)
+    if downsample > 1:
+        gray = cv2.resize(gray, (gray.shape[1] // downsample, gray.shape[0] // downsample),
+                          interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def measure_image(path, downsample=1, store=None):
+    """
+    :param downsample: Decode at 1/2, 1/4 or 1/8 of the size, which is faster but changes the scale of the sharpness
+    :param store: Optional ImageStore, images it holds under the name of path are read from it instead of decoded
+    :return: The sharpness as the variance of the Laplacian and the difference hash of the grayscale image, or None
+    when it can not be read
+    """
+    image = store.get(os.path.basename(path)) if store is not None else None
+    if image is not None:
+        key = (hashlib.sha256(image).hexdigest(), downsample, 'decoded')
+    else:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(e)
+            return None
+        key = (hashlib.sha256(data).hexdigest(), downsample)
+    measure = MEASURES.get(key)
+    if measure is not None:
+        REGISTRY.inc('image_measure_cache_total', description='Sharpness cache lookups', result='hit')
+        return measure
+    REGISTRY.inc('image_measure_cache_total', description='Sharpness cache lookups', result='miss')
+    if image is not None:
+        gray = _grayscale(image, downsample)
+    else:
+        gray = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_GRAYSCALE_FLAGS[downsample])
+    if gray is None:
+        return None
+    measure = (variance_of_laplacian(gray), dhash(gray))
+    MEASURES.put(key, measure)
+    return measure
+
+
+def measure_images(paths, downsample=1, workers=None, store=None):
+    """
+    Measures images on a pool of threads, decoding and filtering release the GIL
+    :param store: Optional ImageStore the images are read from when it holds them
+    :return: A dict of path to the result of measure_image
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return dict(zip(paths, pool.map(lambda path: measure_image(path, downsample, store), paths)))
+
+
 def sharpness(imagePath):
-    try:
-        image = cv2.imread(imagePath)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        fm = variance_of_laplacian(gray)
-        return fm
-    except Exception as e:
-        print(e)
-        return 0
+    measure = measure_image(imagePath)
+    return measure[0] if measure is not None else 0
 
 
 def qvec2rotmat(qvec):
@@ -0,0 +1,133 @@
+import os
+import shutil
+
+import numpy as np
+
+from .common import measure_images
+from src.metrics import REGISTRY
+
+
+def hamming(hashes, value):
+    """
+    :param hashes: A uint64 array of 64 bit hashes
+    :return: The number of bits every hash differs from value in
+    """
+    return np.unpackbits((hashes ^ np.uint64(value)).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def matching_pairs(frames):
+    """
+    Number of image pairs an exhaustive matcher compares
+    """
+    return frames * (frames - 1) // 2
+
+
+class FrameSelector:
+    def __init__(self, min_sharpness=None, relative_sharpness=0.0, max_hash_distance=-1, target_count=None,
+                 downsample=1):
+        """
+        Removes blurry and near duplicate frames before pose estimation, every frame less is a row less of pairs for
+        an exhaustive matcher. Every check is off by default
+        :param min_sharpness: Frames whose variance of the Laplacian is below this are dropped
+        :param relative_sharpness: Frames below this fraction of the median sharpness are dropped, 0 disables it
+        :param max_hash_distance: Frames whose 64 bit difference hash differs from a kept frame in at most this many
+        bits are near duplicates, only the sharper one is kept. A negative value disables it
+        :param target_count: Keep at most this many frames, the frames are split into this many runs in name order
+        and the sharpest of each run is kept so the selection stays spread over the capture
+        :param downsample: Score the frames on a decode at 1/2, 1/4 or 1/8 of their size, the measures are shared
+        with colmap2TransformsJson when it uses the same downsample
+        """
+        self.min_sharpness = min_sharpness
+        self.relative_sharpness = relative_sharpness
+        self.max_hash_distance = max_hash_distance
+        self.target_count = target_count
+        self.downsample = downsample
+
+    def configure(self, **options):
+        """
+        :param options: Parameters to change, named like the arguments of the constructor
+        :return: A new FrameSelector with the given parameters replaced
+        :raises ValueError: for unknown parameters or values that are not numbers
+        """
+        for name, value in options.items():
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f'Frame selection parameter {name!r} must be a number')
+        try:
+            return FrameSelector(**{**vars(self), **options})
+        except TypeError as e:
+            raise ValueError(f'Invalid frame selection parameters: {e}')
+
+    def select(self, images_folder, culled_folder, progress=None, store=None):
+        """
+        Moves the frames that are not selected from images_folder to culled_folder
+        :param progress: Optional callable progress(event, **data) that receives the report as a 'frame_selection'
+        event
+        :param store: Optional ImageStore holding the decoded frames, they are scored on it and the culled ones are
+        encoded to culled_folder and removed from it
+        :return: A report of the removed frames and the matching pairs saved
+        """
+        names = store.names() if store is not None else sorted(os.listdir(images_folder))
+        measured = measure_images([os.path.join(images_folder, name) for name in names], downsample=self.downsample,
+                                  store=store)
+        measures = {os.path.basename(path): measure for path, measure in measured.items() if measure is not None}
+        frames = [name for name in names if name in measures]
+
+        sharpness = np.array([measures[name][0] for name in frames])
+        threshold = self.min_sharpness or 0.0
+        if self.relative_sharpness and len(frames):
+            threshold = max(threshold, self.relative_sharpness * float(np.median(sharpness)))
+        blurry = [name for name in frames if measures[name][0] < threshold]
+        if len(blurry) == len(frames):
+            # A threshold nothing passes says more about the threshold than about the frames
+            blurry = []
+        frames = [name for name in frames if measures[name][0] >= threshold] if blurry else frames
+
+        duplicates = []
+        if self.max_hash_distance is not None and self.max_hash_distance >= 0:
+            kept = []
+            hashes = np.empty(len(frames), dtype=np.uint64)
+            for name in frames:
+                sharp, value = measures[name]
+                distances = hamming(hashes[:len(kept)], value)
+                match = int(np.argmin(distances)) if len(kept) else -1
+                if match < 0 or distances[match] > self.max_hash_distance:
+                    hashes[len(kept)] = value
+                    kept.append(name)
+                elif sharp > measures[kept[match]][0]:
+                    duplicates.append(kept[match])
+                    kept[match] = name
+                    hashes[match] = value
+                else:
+                    duplicates.append(name)
+            frames = sorted(kept)
+
+        over_target = []
+        if self.target_count and len(frames) > self.target_count:
+            runs = np.array_split(np.arange(len(frames)), self.target_count)
+            selected = {frames[max(run, key=lambda i: measures[frames[i]][0])] for run in runs}
+            over_target = [name for name in frames if name not in selected]
+            frames = [name for name in frames if name in selected]
+
+        culled = blurry + duplicates + over_target
+        if culled:
+            os.makedirs(culled_folder, exist_ok=True)
+        if culled and store is not None:
+            # Their source files are already gone, this is the only copy left to recover them from
+            store.export(culled_folder, names=culled)
+        for name in culled:
+            if store is not None:
+                store.discard(name)
+            if os.path.exists(os.path.join(images_folder, name)):
+                shutil.move(os.path.join(images_folder, name), os.path.join(culled_folder, name))
+        for reason, removed in (('blurry', blurry), ('duplicate', duplicates), ('over_target', over_target)):
+            if removed:
+                REGISTRY.inc('frames_culled_total', len(removed), description='Frames removed before pose estimation',
+                             reason=reason)
+
+        total = len(measures)
+        report = {'total': total, 'kept': len(frames), 'sharpness_threshold': threshold, 'blurry': blurry,
+                  'duplicates': sorted(duplicates), 'over_target': over_target,
+                  'matching_pairs_saved': matching_pairs(total) - matching_pairs(len(frames))}
+        if progress is not None:
+            progress('frame_selection', **report)
+        return report
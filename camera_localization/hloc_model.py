@@ -1,14 +1,16 @@
 from pathlib import Path
 from hloc import extract_features, match_features, reconstruction, pairs_from_exhaustive
-from .common import colmap2TransformsJson, run_colmap_model_converter
+from .common import colmap2TransformsJson, run_colmap_model_converter, sfm_step
 
 
 class HLOCPredictOptions:
-    def __init__(self, path, images_folder, output_path, aabb_scale=32, skip_early=0, text='colmap_text'):
+    def __init__(self, path, images_folder, output_path, aabb_scale=32, skip_early=0, text='colmap_text',
+                 image_store=None):
         """
         :param path: Path that contains images_folder
         :param images_folder: name of images_folder
         :param output_path: output_path of hloc
+        :param image_store: Optional ImageStore holding the decoded images, colmap2TransformsJson reads them from it
         """
         self.path = path
         self.output_path = output_path
@@ -16,13 +18,17 @@ class HLOCPredictOptions:
         self.aabb_scale = aabb_scale
         self.skip_early = skip_early
         self.text = text
+        self.image_store = image_store
 
 
 class HLOCModel:
     def __init__(self):
         super().__init__()
 
-    def predict(self, opts: HLOCPredictOptions):
+    def predict(self, opts: HLOCPredictOptions, progress=None):
+        """
+        :param progress: Optional callable progress(event, **data) notified at the boundaries of every HLOC step
+        """
         # Define the paths
         images = Path(opts.path) / opts.images_folder
         outputs = Path(opts.path)
@@ -42,14 +48,21 @@ class HLOCModel:
         print(len(references), "mapping images")
 
         # Run the feature extraction, pairs generation, and feature matching
-        extract_features.main(feature_conf, images, image_list=references, feature_path=features)
-        pairs_from_exhaustive.main(sfm_pairs, image_list=references)
-        match_features.main(matcher_conf, sfm_pairs, features=features, matches=matches)
-        reconstruction.main(sfm_dir, images, sfm_pairs, features, matches, image_list=references)
-        run_colmap_model_converter(input_path=sfm_dir, output_path=sfm_dir, output_type='TXT')
-        colmap2TransformsJson(aabb_scale=opts.aabb_scale,
-                              skip_early=opts.skip_early,
-                              path=opts.path,
-                              output_path=opts.output_path,
-                              images_folder=opts.images_folder,
-                              text=opts.text)
+        with sfm_step(progress, 'extract_features'):
+            extract_features.main(feature_conf, images, image_list=references, feature_path=features)
+        with sfm_step(progress, 'pairs_from_exhaustive'):
+            pairs_from_exhaustive.main(sfm_pairs, image_list=references)
+        with sfm_step(progress, 'match_features'):
+            match_features.main(matcher_conf, sfm_pairs, features=features, matches=matches)
+        with sfm_step(progress, 'reconstruction'):
+            reconstruction.main(sfm_dir, images, sfm_pairs, features, matches, image_list=references)
+        with sfm_step(progress, 'model_converter'):
+            run_colmap_model_converter(input_path=sfm_dir, output_path=sfm_dir, output_type='TXT')
+        with sfm_step(progress, 'colmap2TransformsJson'):
+            colmap2TransformsJson(aabb_scale=opts.aabb_scale,
+                                  skip_early=opts.skip_early,
+                                  path=opts.path,
+                                  output_path=opts.output_path,
+                                  images_folder=opts.images_folder,
+                                  text=opts.text,
+                                  image_store=opts.image_store)
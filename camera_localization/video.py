@@ -0,0 +1,125 @@
+import os
+
+import cv2
+import numpy as np
+
+from .common import variance_of_laplacian
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v')
+
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def parse_time_slice(time_slice):
+    """
+    :param time_slice: "t1,t2" in seconds, or an empty string for the whole video
+    :return: A (start, end) tuple of seconds
+    """
+    if not time_slice:
+        return 0.0, float('inf')
+    start, end = time_slice.split(",")
+    return float(start), float(end)
+
+
+class KeyframeExtractor:
+    def __init__(self, min_motion=0.05, window=5, analysis_width=320, max_features=200, max_frames=None,
+                 min_change=0.05):
+        """
+        Decodes a video in process and selects keyframes from how far the camera moved since the last keyframe and
+        how sharp the frames are, instead of sampling at a fixed rate
+        :param min_motion: Median feature displacement since the last keyframe, as a fraction of the frame diagonal,
+        from which frames become candidates for the next keyframe
+        :param window: Number of candidates the sharpest is picked from
+        :param analysis_width: Width of the grayscale copy motion and sharpness are measured on
+        :param max_features: Corners tracked from the last keyframe
+        :param max_frames: Stop after this many keyframes
+        :param min_change: Mean absolute intensity difference to the last keyframe, as a fraction of 255, from which
+        frames become candidates when the last keyframe has too few features to track
+        """
+        self.min_motion = min_motion
+        self.min_change = min_change
+        self.window = window
+        self.analysis_width = analysis_width
+        self.max_features = max_features
+        self.max_frames = max_frames
+
+    def _analysis_copy(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = self.analysis_width / gray.shape[1]
+        if scale < 1:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _features(self, gray):
+        return cv2.goodFeaturesToTrack(gray, self.max_features, 0.01, 7)
+
+    def motion(self, reference, features, gray):
+        """
+        :return: The median displacement of the features of the reference in gray, relative to the frame diagonal, or
+        None when the reference has too few features to track
+        """
+        diagonal = float(np.hypot(*gray.shape))
+        if features is None or len(features) < 8:
+            return None
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(reference, gray, features, None)
+        found = status.ravel() == 1
+        if found.sum() < 8:
+            # Tracking was lost, the camera moved a lot
+            return 1.0
+        return float(np.median(np.linalg.norm((tracked - features)[found], axis=-1))) / diagonal
+
+    def moved(self, reference, features, gray):
+        """
+        :return: Whether gray moved far enough from the reference to be a candidate for the next keyframe
+        """
+        motion = self.motion(reference, features, gray)
+        if motion is None:
+            # Nothing to track, fall back to how much the image changed
+            return float(cv2.absdiff(reference, gray).mean()) / 255 >= self.min_change
+        return motion >= self.min_motion
+
+    def keyframes(self, video_path, time_slice=""):
+        """
+        :param time_slice: "t1,t2" in seconds to only select keyframes between t1 and t2
+        :return: A generator of (timestamp in seconds, BGR frame) tuples
+        """
+        start, end = parse_time_slice(time_slice)
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise ValueError(f'Could not open video {video_path}')
+        try:
+            if start > 0:
+                capture.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+            fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            reference = features = None
+            candidates = []
+            selected = 0
+            index = -1
+            while self.max_frames is None or selected < self.max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                index += 1
+                timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000 or start + index / fps
+                if timestamp < start:
+                    continue
+                if timestamp > end:
+                    break
+                gray = self._analysis_copy(frame)
+                if reference is not None and not self.moved(reference, features, gray):
+                    continue
+                candidates.append((variance_of_laplacian(gray), timestamp, frame, gray))
+                if len(candidates) < self.window:
+                    continue
+                _, timestamp, frame, reference = max(candidates, key=lambda candidate: candidate[0])
+                features = self._features(reference)
+                candidates = []
+                selected += 1
+                yield timestamp, frame
+            if candidates and (self.max_frames is None or selected < self.max_frames):
+                _, timestamp, frame, _ = max(candidates, key=lambda candidate: candidate[0])
+                yield timestamp, frame
+        finally:
+            capture.release()
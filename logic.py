@@ -1,60 +1,232 @@
-from camera_localization.colmap import ColMapLocalization, ColmapLocalizationPredictOptions
-from camera_localization.hloc_model import HLOCModel, HLOCPredictOptions
-from preprocessing_wizards import *
-import cv2
+import camera_localization
+import preprocessing_wizards as wizards
+from preprocessing_wizards.executor import PreprocessingExecutor, PreprocessResult
+from preprocessing_wizards.cache import PreprocessCache
+from camera_localization.frame_selection import FrameSelector
+from camera_localization.video import KeyframeExtractor, is_video, parse_time_slice
+from concurrent.futures import Future
+import contextlib
+import functools
 import os
+import shutil
 import time
 from src.GLOBAL import GLOBAL
-from model.instant_ngp import InstantNGPPredictOptions, InstantNGP
+from src.image_store import ImageStore
+from src.workspace import Workspace
+from src.metrics import REGISTRY
+from src.registry import LazyRegistry
+from model.instant_ngp_options import InstantNGPPredictOptions
 
-poseEstimators = {'colmap': (ColMapLocalization(), ColmapLocalizationPredictOptions('', '', '')),
-                  'hloc': (HLOCModel(), HLOCPredictOptions('', '', ''))}
-preprocessing_wizards = {'clahe': CLAHE(2.0, (8, 8)),
-                         'filtering': Filtering(),
-                         'augmentation': Augmentation(),
-                         'white balancing': WhiteBalancing(),
-                         'white_balancing': WhiteBalancing()}
+# Estimators and wizards are created on first use so their heavy dependencies are not imported at startup
+poseEstimators = LazyRegistry({'colmap': lambda: (camera_localization.ColMapLocalization(),
+                                                  functools.partial(
+                                                      camera_localization.ColmapLocalizationPredictOptions,
+                                                      keyframe_motion=GLOBAL.keyframe_motion)),
+                               'hloc': lambda: (camera_localization.HLOCModel(),
+                                                camera_localization.HLOCPredictOptions)})
+preprocessing_wizards = LazyRegistry({'clahe': lambda: wizards.CLAHE(2.0, (8, 8)),
+                                      'filtering': lambda: wizards.Filtering(),
+                                      'augmentation': lambda: wizards.Augmentation(),
+                                      'white balancing': lambda: wizards.WhiteBalancing(),
+                                      'white_balancing': lambda: wizards.WhiteBalancing(),
+                                      'gamma': lambda: wizards.GammaCorrection(gamma=0.8)})
+# Shared by all jobs so the number of decoded images in memory is bounded for the whole server
+preprocessor = PreprocessingExecutor(GLOBAL.preprocess_workers, GLOBAL.preprocess_in_flight,
+                                     cache=PreprocessCache(GLOBAL.preprocess_cache_dir,
+                                                           int(GLOBAL.preprocess_cache_quota * 1024 ** 3)))
+frame_selector = FrameSelector(GLOBAL.min_sharpness, GLOBAL.relative_sharpness, GLOBAL.max_hash_distance,
+                               GLOBAL.target_frames)
+keyframe_extractor = KeyframeExtractor(min_motion=GLOBAL.keyframe_motion)
+models = ('nerf', 'gtsfm')
 
 
-def reconstruct(path: str, preprocessing_pipeline: list, model: str, pose_estimator: str):
-    path = os.path.abspath(path)
-    # Preprocess
-    pipeline = [Resizing(high=2773, low=1560)]
+def build_pipeline(preprocessing_pipeline: list):
+    """
+    :param preprocessing_pipeline: Names of wizards, or dicts with the name of a wizard and parameters that replace
+    its defaults, e.g. {"name": "filtering", "mode": "approximate", "quality": 0.25}
+    :raises ValueError: for unknown wizards or parameters, or when the pipeline is not a list
+    """
+    if not isinstance(preprocessing_pipeline, list):
+        raise ValueError(f'Preprocessing must be a list, got {type(preprocessing_pipeline).__name__}')
+    pipeline = [wizards.Resizing(high=2773, low=1560)]
     for i in preprocessing_pipeline:
-        pipeline.append(preprocessing_wizards[i])
-    imgs_path = os.path.join(path, 'images')
-    tic_pp = time.perf_counter()
-    for name in os.listdir(imgs_path):
-        img = cv2.imread(os.path.join(imgs_path, name))
-        p_img = PPWizard.run_pipeline(img, pipeline)
-        cv2.imwrite(os.path.join(imgs_path, name), p_img[0])
-    toc_pp = time.perf_counter()
-
-    # Estimate Pose
+        options = dict(i) if isinstance(i, dict) else {'name': i}
+        name = options.pop('name', None)
+        if not isinstance(name, str) or name not in preprocessing_wizards:
+            raise ValueError(f'Unknown preprocessing wizard {name!r}')
+        wizard = preprocessing_wizards[name]
+        if options:
+            try:
+                wizard = wizard.configure(**options)
+            except TypeError as e:
+                raise ValueError(f'Invalid parameters for {name!r}: {e}')
+        pipeline.append(wizard)
+    return pipeline
+
+
+def image_store(workspace: Workspace):
+    """
+    :return: The ImageStore preprocessed images of the workspace are kept in until pose estimation, or None when they
+    are encoded right after preprocessing
+    """
+    return ImageStore(workspace.decoded) if GLOBAL.decoded_store else None
+
+
+def job_frame_selector(options=None):
+    """
+    :param options: Parameters of FrameSelector that replace the server defaults for a job, e.g.
+    {"relative_sharpness": 0.2, "max_hash_distance": 3}. Frames are only culled when the job or the server asks for it
+    :raises ValueError: for options that are not a dict of known parameters
+    """
+    if options is None:
+        return frame_selector
+    if not isinstance(options, dict) or not all(isinstance(name, str) for name in options):
+        raise ValueError('Frame selection must be a dict of parameter names to values')
+    return frame_selector.configure(**options)
+
+
+def valid_time_slice(time_slice):
+    """
+    :param time_slice: "t1,t2" in seconds, or an empty string for the whole video
+    """
+    if not isinstance(time_slice, str):
+        return False
+    try:
+        start, end = parse_time_slice(time_slice)
+    except ValueError:
+        return False
+    return 0 <= start <= end
+
+
+def preprocess_video(path: str, pipeline: list, progress, store=None, time_slice=""):
+    """
+    Streams the keyframes of a video straight into the preprocessor, they are only encoded once after preprocessing
+    as {stem}_{k}.jpg next to the video, which is removed afterwards
+    :param store: Optional ImageStore the preprocessed keyframes are kept in instead of being encoded
+    :param time_slice: "t1,t2" in seconds to only select keyframes between t1 and t2
+    :return: A list of futures of PreprocessResult, one per keyframe, or a single failed result when the video can
+    not be read
+    """
+    stem = os.path.splitext(path)[0]
+    futures = []
+    try:
+        with REGISTRY.timed('keyframe_extraction', 'Duration of selecting and decoding the keyframes of a video'):
+            for k, (timestamp, frame) in enumerate(keyframe_extractor.keyframes(path, time_slice)):
+                futures.append(preprocessor.submit(f'{stem}_{k:04d}.jpg', pipeline, image=frame, store=store))
+    except ValueError as e:
+        # Fails like an image that can not be decoded instead of failing the whole job
+        REGISTRY.inc('image_preprocessing_errors_total', description='Images that could not be preprocessed')
+        failed = Future()
+        failed.set_result(PreprocessResult(path, error=str(e)))
+        return futures + [failed]
+    progress('keyframes', video=os.path.basename(path), selected=len(futures))
+    os.remove(path)
+    return futures
+
+
+def handle_preprocessing_failures(workspace: Workspace, results: list, progress):
+    """
+    Moves the images that could not be preprocessed out of the images folder so pose estimation skips them
+    :param results: PreprocessResult of every image of the workspace
+    :raises RuntimeError: when no image could be preprocessed
+    """
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        progress('preprocessing_failed', image=result.name, error=result.error)
+        os.makedirs(workspace.failed, exist_ok=True)
+        if os.path.exists(result.path):
+            shutil.move(result.path, os.path.join(workspace.failed, result.name))
+    if results and len(failed) == len(results):
+        raise RuntimeError(f'None of the {len(results)} images could be preprocessed: {failed[0].error}')
+
+
+def ngp_options(workspace: Workspace):
+    return InstantNGPPredictOptions(workspace.path, GLOBAL.instant_ngp, save_mesh=workspace.mesh,
+                                    save_snapshot=workspace.snapshot, marching_cubes_res=512,
+                                    marching_cubes_thresh=2.5)
+
+
+def reconstruct(path: str, preprocessing_pipeline: list, model: str, pose_estimator: str, progress=None,
+                preprocess=True, admission=None, pending=None, time_slice="", frame_selection=None):
+    """
+    :param path: Workspace directory of the reconstruction, results are written to its results folder
+    :param progress: Optional callable progress(event, **data) that is notified about stage transitions, preprocessed
+    images, pose estimation steps and training
+    :param preprocess: Set to False when the images were already submitted for preprocessing while they were ingested
+    :param pending: Futures of PreprocessResult of the images submitted while they were ingested, they are waited for
+    while holding the 'sfm' slot
+    :param admission: Optional AdmissionController, preprocessing and pose estimation hold one of its 'sfm' slots and
+    training holds one of its 'training' slots
+    :param time_slice: "t1,t2" in seconds to only select keyframes of videos between t1 and t2
+    :param frame_selection: Optional parameters of the FrameSelector of the job, see job_frame_selector
+    :return: A dict of artifact name to artifact path
+    :raises ValueError: for unknown pose estimators or models, before any work is done
+    """
     if pose_estimator not in poseEstimators:
-        return
-    tic_pe = time.perf_counter()
-    pose_tuple = poseEstimators[pose_estimator]
-    pose_tuple[1].path = path
-    pose_tuple[1].images_folder = 'images'
-    pose_tuple[1].output_path = os.path.join(path, 'transforms.json')
-    pose_tuple[0].predict(pose_tuple[1])
-    toc_pe = time.perf_counter()
+        raise ValueError(f'Unknown pose estimator {pose_estimator!r}')
+    if model not in models:
+        raise ValueError(f'Unknown model {model!r}')
+    if progress is None:
+        progress = lambda event, **data: None
+    slot = admission.slot if admission is not None else lambda stage_type: contextlib.nullcontext()
+    workspace = Workspace(path)
+    path = workspace.path
+    artifacts = {}
+    with slot('sfm'):
+        # Preprocess
+        progress('stage', stage='preprocessing')
+        pipeline = build_pipeline(preprocessing_pipeline)
+        imgs_path = workspace.images
+        store = image_store(workspace)
+        tic_pp = time.perf_counter()
+        paths = [os.path.join(imgs_path, name) for name in sorted(os.listdir(imgs_path))]
+        keyframes = [future for path in paths if is_video(path)
+                     for future in preprocess_video(path, pipeline, progress, store, time_slice)]
+        if preprocess:
+            results = preprocessor.map([path for path in paths if not is_video(path)], pipeline, progress, store)
+        else:
+            results = [future.result() for future in pending or []]
+            progress('preprocessing', done=len(results), total=len(results), final=True)
+        results += [future.result() for future in keyframes]
+        handle_preprocessing_failures(workspace, results, progress)
+        toc_pp = time.perf_counter()
+        REGISTRY.observe('stage_seconds', toc_pp - tic_pp, 'Duration of a reconstruction stage', stage='preprocessing')
+
+        # Estimate Pose
+        progress('stage', stage='frame_selection')
+        with REGISTRY.timed('frame_selection', 'Duration of removing blurry and duplicate frames'):
+            job_frame_selector(frame_selection).select(imgs_path, workspace.culled, progress=progress, store=store)
+        if store is not None:
+            # COLMAP and HLOC read files, only the frames that were kept get encoded
+            with REGISTRY.timed('image_export', 'Duration of encoding the decoded images for pose estimation'):
+                store.export(imgs_path)
+        progress('stage', stage='pose_estimation')
+        tic_pe = time.perf_counter()
+        estimator, estimator_options = poseEstimators[pose_estimator]
+        # Options are created per call so concurrent jobs never share them
+        estimator.predict(estimator_options(path, 'images', workspace.transforms, image_store=store), progress=progress)
+        toc_pe = time.perf_counter()
+        REGISTRY.observe('stage_seconds', toc_pe - tic_pe, 'Duration of a reconstruction stage',
+                         stage='pose_estimation', estimator=pose_estimator)
     # Reconstruct
     if model == 'nerf':
-        tic_rec = time.perf_counter()
-        opts = InstantNGPPredictOptions(os.path.abspath(path), GLOBAL.instant_ngp, save_mesh='./Results/nerfmesh.obj',
-                                        save_snapshot='./Results/nerfsnapshot.ingp', marching_cubes_res=512,
-                                        marching_cubes_thresh=2.5)
-        InstantNGP().predict(opts)
-        toc_rec = time.perf_counter()
+        with slot('training'):
+            progress('stage', stage='training')
+            tic_rec = time.perf_counter()
+            opts = ngp_options(workspace)
+            from model.instant_ngp import InstantNGP
+            InstantNGP().predict(opts, progress=progress)
+            toc_rec = time.perf_counter()
+        REGISTRY.observe('stage_seconds', toc_rec - tic_rec, 'Duration of a reconstruction stage', stage='training')
+        artifacts['snapshot'] = opts.save_snapshot
+        artifacts['mesh'] = opts.save_mesh
         print(f"Time for preprocessing: {toc_pp - tic_pp:0.4f}")
         print(f"Time for pose: {toc_pe - tic_pe:0.4f}")
         print(f"Time for reconstruction: {toc_rec - tic_rec:0.4f}")
     elif model == 'gtsfm':
         pass
-    else:
-        raise ValueError()
+    progress('stage', stage='done')
+    return artifacts
 
 
 import json
@@ -66,7 +238,7 @@ def bytes_to_json_dict(data):
   extracts a chunk of bytes, converts them to a UTF-8 string, and attempts to parse it as a JSON dictionary.
 
   Args:
-      data: The byte array containing the data.
+      data: The byte array (or a memoryview over it) containing the data.
 
   Returns:
       A Python dictionary representing the parsed JSON data, or None if parsing fails.
@@ -79,7 +251,7 @@ def bytes_to_json_dict(data):
 
     # Try to decode the bytes as UTF-8 and parse as JSON
     try:
-        json_string = chunk.decode('utf-8')
+        json_string = str(chunk, 'utf-8')
         return json.loads(json_string)
     except (UnicodeDecodeError, json.JSONDecodeError):
         # Handle potential decoding or parsing errors
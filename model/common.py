@@ -9,6 +9,7 @@
 # license agreement from NVIDIA CORPORATION is strictly prohibited.
 
 import code
+import functools
 import glob
 import imageio
 import numpy as np
@@ -120,7 +121,8 @@ def diagonally_combine_images(images, x_thresholds, angle, gap=0, color=1):
 	return result
 
 def write_image_imageio(img_file, img, quality):
-	img = (np.clip(img, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+	if img.dtype != np.uint8:
+		img = (np.clip(img, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
 	kwargs = {}
 	if os.path.splitext(img_file)[1].lower() in [".jpg", ".jpeg"]:
 		if img.ndim >= 3 and img.shape[2] > 3:
@@ -144,38 +146,255 @@ def linear_to_srgb(img):
 	limit = 0.0031308
 	return np.where(img > limit, 1.055 * (img ** (1.0 / 2.4)) - 0.055, 12.92 * img)
 
+def half_values():
+	# Every float16 value, in the order of their bit patterns
+	return np.arange(65536, dtype=np.uint16).view(np.float16).astype(np.float32)
+
+@functools.lru_cache(maxsize=None)
+def srgb_to_linear_table(dtype):
+	# 256 entries for uint8, 65536 for uint16 and for the bit patterns of float16
+	dtype = np.dtype(dtype)
+	if dtype == np.uint8:
+		values = np.arange(256, dtype=np.float32) / 255.0
+	elif dtype == np.uint16:
+		values = np.arange(65536, dtype=np.float32) / 65535.0
+	elif dtype == np.float16:
+		values = half_values()
+	else:
+		raise ValueError(f"No sRGB lookup table for {dtype}")
+	with np.errstate(invalid="ignore", over="ignore"):
+		return np.nan_to_num(srgb_to_linear(values)).astype(np.float32)
+
+def quantize_srgb(srgb):
+	# The quantization of write_image_imageio
+	return (np.clip(srgb, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+@functools.lru_cache(maxsize=None)
+def linear_to_srgb_table(dtype):
+	# Indexed by the bit patterns of float16
+	with np.errstate(invalid="ignore", over="ignore"):
+		srgb = np.nan_to_num(linear_to_srgb(half_values())).astype(np.float32)
+	return quantize_srgb(srgb) if np.dtype(dtype) == np.uint8 else srgb
+
+SRGB8_BUCKET_BITS = 13
+
+@functools.lru_cache(maxsize=None)
+def linear_to_srgb8_tables():
+	# float32 values in [0, 1] fall in buckets of their bit pattern without the 13 lowest mantissa bits, every bucket
+	# is narrower than the distance between two steps of the quantized sRGB. So the value at the start of the bucket,
+	# plus one where the value reaches the next step, is exactly what linear_to_srgb and quantize_srgb give
+	quantize = lambda x: quantize_srgb(linear_to_srgb(x))
+	one = int(np.float32(1.0).view(np.uint32))
+	starts = (np.arange((one >> SRGB8_BUCKET_BITS) + 1, dtype=np.uint32) << SRGB8_BUCKET_BITS).view(np.float32)
+	table = quantize(starts)
+	# Smallest float32 reaching every step, bisected on the bit patterns
+	k = np.arange(1, 256)
+	low, high = np.zeros(255, dtype=np.int64), np.full(255, one, dtype=np.int64)
+	while np.any(high - low > 1):
+		middle = (low + high) // 2
+		reached = quantize(middle.astype(np.uint32).view(np.float32)) >= k
+		high, low = np.where(reached, middle, high), np.where(reached, low, middle)
+	steps = np.concatenate((high.astype(np.uint32).view(np.float32), [np.inf])).astype(np.float32)
+	return table, steps[table]
+
+def linear_to_srgb8(img, out=None):
+	# float32 linear values to quantized 8-bit sRGB, identical to quantize_srgb(linear_to_srgb(img))
+	table, next_steps = linear_to_srgb8_tables()
+	if out is None:
+		out = np.empty(img.shape, dtype=np.uint8)
+	# fmax and fmin map NaN to 0 like the conversion to uint8 does
+	x = np.fmax(img, 0.0, dtype=np.float32)
+	np.fmin(x, 1.0, out=x)
+	index = np.right_shift(x.view(np.uint32), SRGB8_BUCKET_BITS)
+	np.take(table, index, out=out, mode="clip")
+	out += x >= np.take(next_steps, index, mode="clip")
+	return out
+
+def srgb_to_linear_lut(img, out=None):
+	# img is uint8, uint16 or float16, out defaults to a new float32 array
+	index = img.view(np.uint16) if img.dtype == np.float16 else img
+	return np.take(srgb_to_linear_table(img.dtype.type), index, out=out, mode="clip")
+
+def linear_to_srgb_lut(img, out=None, dtype=np.float32):
+	# out decides between uint8 and float32 results. float16 inputs are looked up by their bit pattern, float32
+	# inputs quantized to uint8 by linear_to_srgb8, anything else falls back to linear_to_srgb
+	dtype = out.dtype if out is not None else np.dtype(dtype)
+	if img.dtype == np.float16:
+		return np.take(linear_to_srgb_table(dtype.type), img.view(np.uint16), out=out, mode="clip")
+	if img.dtype == np.float32 and dtype == np.uint8:
+		return linear_to_srgb8(img, out=out)
+	srgb = linear_to_srgb(img)
+	if dtype == np.uint8:
+		srgb = quantize_srgb(srgb)
+	if out is None:
+		return srgb.astype(dtype)
+	out[...] = srgb
+	return out
+
+def premultiply(img):
+	np.multiply(img[...,0:3], img[...,3:4], out=img[...,0:3])
+	return img
+
+def unmultiply(img):
+	alpha = img[...,3:4]
+	# Dividing everywhere and zeroing the transparent pixels afterwards is faster than a masked divide
+	with np.errstate(divide="ignore", invalid="ignore"):
+		np.divide(img[...,0:3], alpha, out=img[...,0:3])
+	np.copyto(img[...,0:3], 0, where=alpha == 0)
+	return img
+
+TILED_BIN_MAGIC = b"TBIN"
+
+def to_rgba_half(img, out=None):
+	if out is None:
+		out = np.empty(img.shape[:2] + (4,), dtype=np.float16)
+	channels = img.shape[2] if img.ndim == 3 else 1
+	out[...,:channels] = img if img.ndim == 3 else img[...,np.newaxis]
+	out[...,channels:] = 1
+	return out
+
+class TiledBinImage:
+	# Tiled variant of the .bin format: magic, height, width, tile height and tile width, then the byte offset of
+	# every tile in row major order, then the tiles as float16 RGBA. Only the tiles a region overlaps are paged in.
+	def __init__(self, file):
+		with open(file, "rb") as f:
+			if f.read(4) != TILED_BIN_MAGIC:
+				raise ValueError(f"{file} is not a tiled .bin image")
+			h, w, self.tile_h, self.tile_w = struct.unpack("iiii", f.read(16))
+		self.shape = (h, w, 4)
+		self.tiles_y = -(-h // self.tile_h)
+		self.tiles_x = -(-w // self.tile_w)
+		self.data = np.memmap(file, dtype=np.uint8, mode="r")
+		self.index = self.data[20:20 + 8 * self.tiles_y * self.tiles_x].view(np.uint64).reshape(self.tiles_y, self.tiles_x)
+
+	def tile(self, ty, tx):
+		h = min(self.tile_h, self.shape[0] - ty * self.tile_h)
+		w = min(self.tile_w, self.shape[1] - tx * self.tile_w)
+		offset = int(self.index[ty, tx])
+		return self.data[offset:offset + h * w * 8].view(np.float16).reshape(h, w, 4)
+
+	def read(self, y0=0, x0=0, y1=None, x1=None, dtype=np.float16, out=None):
+		y1 = self.shape[0] if y1 is None else min(y1, self.shape[0])
+		x1 = self.shape[1] if x1 is None else min(x1, self.shape[1])
+		if out is None:
+			out = np.empty((y1 - y0, x1 - x0, 4), dtype=dtype)
+		for ty in range(y0 // self.tile_h, -(-y1 // self.tile_h)):
+			for tx in range(x0 // self.tile_w, -(-x1 // self.tile_w)):
+				tile = self.tile(ty, tx)
+				oy, ox = ty * self.tile_h, tx * self.tile_w
+				sy0, sy1 = max(y0, oy), min(y1, oy + tile.shape[0])
+				sx0, sx1 = max(x0, ox), min(x1, ox + tile.shape[1])
+				out[sy0-y0:sy1-y0, sx0-x0:sx1-x0] = tile[sy0-oy:sy1-oy, sx0-ox:sx1-ox]
+		return out
+
+class BinImageWriter:
+	# Writes a .bin image row by row, tiled when tile is given, so the image never has to exist as a whole in float16
+	def __init__(self, file, h, w, tile=None):
+		self.f = open(file, "wb")
+		self.h, self.w = h, w
+		self.rows = 0
+		self.tiled = tile is not None
+		if not self.tiled:
+			self.f.write(struct.pack("ii", h, w))
+			return
+		self.tile_h, self.tile_w = (tile, tile) if np.isscalar(tile) else tile
+		heights = np.minimum(self.tile_h, h - np.arange(0, h, self.tile_h))
+		widths = np.minimum(self.tile_w, w - np.arange(0, w, self.tile_w))
+		sizes = (heights[:,np.newaxis] * widths[np.newaxis,:] * 8).ravel()
+		offsets = 20 + 8 * sizes.size + np.concatenate(([0], np.cumsum(sizes)[:-1]))
+		self.f.write(TILED_BIN_MAGIC + struct.pack("iiii", h, w, self.tile_h, self.tile_w))
+		self.f.write(offsets.astype(np.uint64).tobytes())
+		self.pending = np.empty((self.tile_h, w, 4), dtype=np.float16)
+		self.pending_rows = 0
+
+	def write_rows(self, rows):
+		if self.rows + rows.shape[0] > self.h:
+			raise ValueError(f"Writing {rows.shape[0]} rows past the height of {self.h}")
+		if rows.shape[1] != self.w:
+			raise ValueError(f"Rows of width {rows.shape[1]} do not match the width of {self.w}")
+		self.rows += rows.shape[0]
+		if not self.tiled:
+			self.f.write(to_rgba_half(rows).tobytes())
+			return
+		while rows.shape[0]:
+			n = min(self.tile_h - self.pending_rows, rows.shape[0])
+			to_rgba_half(rows[:n], out=self.pending[self.pending_rows:self.pending_rows + n])
+			self.pending_rows += n
+			rows = rows[n:]
+			if self.pending_rows == self.tile_h:
+				self.flush_tiles()
+
+	def flush_tiles(self):
+		for x in range(0, self.w, self.tile_w):
+			self.f.write(self.pending[:self.pending_rows, x:x + self.tile_w].tobytes())
+		self.pending_rows = 0
+
+	def close(self):
+		if self.tiled and self.pending_rows:
+			self.flush_tiles()
+		self.f.close()
+		if self.rows != self.h:
+			raise ValueError(f"Wrote {self.rows} of {self.h} rows")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		if type is None:
+			self.close()
+		else:
+			self.f.close()
+
+def read_image_bin(file, dtype=np.float16):
+	# Maps the image instead of reading it, float16 reads are views of the file
+	with open(file, "rb") as f:
+		header = f.read(8)
+	if header[:4] == TILED_BIN_MAGIC:
+		return TiledBinImage(file).read(dtype=dtype)
+	h, w = struct.unpack("ii", header)
+	img = np.memmap(file, dtype=np.float16, mode="r", offset=8, shape=(h, w, 4))
+	return img if np.dtype(dtype) == np.float16 else img.astype(dtype)
+
+def write_image_bin(file, img, tile=None, rows=256):
+	with BinImageWriter(file, img.shape[0], img.shape[1], tile=tile) as writer:
+		for y in range(0, img.shape[0], rows):
+			writer.write_rows(img[y:y + rows])
+
 def read_image(file):
 	if os.path.splitext(file)[1] == ".bin":
-		with open(file, "rb") as f:
-			bytes = f.read()
-			h, w = struct.unpack("ii", bytes[:8])
-			img = np.frombuffer(bytes, dtype=np.float16, count=h*w*4, offset=8).astype(np.float32).reshape([h, w, 4])
+		img = read_image_bin(file, np.float32)
 	else:
-		img = read_image_imageio(file)
-		if img.shape[2] == 4:
-			img[...,0:3] = srgb_to_linear(img[...,0:3])
-			# Premultiply alpha
-			img[...,0:3] *= img[...,3:4]
+		raw = np.asarray(imageio.imread(file))
+		if raw.ndim == 2:
+			raw = raw[:,:,np.newaxis]
+		if raw.dtype in (np.uint8, np.uint16):
+			# 16 bit sources use their full range instead of being divided by 255
+			img = srgb_to_linear_lut(raw, out=np.empty(raw.shape, dtype=np.float32))
+			if img.shape[2] == 4:
+				img[...,3] = raw[...,3]
+				img[...,3] /= np.iinfo(raw.dtype).max
+				premultiply(img)
 		else:
-			img = srgb_to_linear(img)
+			img = raw.astype(np.float32) / 255.0
+			if img.shape[2] == 4:
+				img[...,0:3] = srgb_to_linear(img[...,0:3])
+				# Premultiply alpha
+				premultiply(img)
+			else:
+				img = srgb_to_linear(img)
 	return img
 
 def write_image(file, img, quality=95):
 	if os.path.splitext(file)[1] == ".bin":
-		if img.shape[2] < 4:
-			img = np.dstack((img, np.ones([img.shape[0], img.shape[1], 4 - img.shape[2]])))
-		with open(file, "wb") as f:
-			f.write(struct.pack("ii", img.shape[0], img.shape[1]))
-			f.write(img.astype(np.float16).tobytes())
+		write_image_bin(file, img)
 	else:
 		if img.shape[2] == 4:
-			img = np.copy(img)
-			# Unmultiply alpha
-			img[...,0:3] = np.divide(img[...,0:3], img[...,3:4], out=np.zeros_like(img[...,0:3]), where=img[...,3:4] != 0)
-			img[...,0:3] = linear_to_srgb(img[...,0:3])
-		else:
-			img = linear_to_srgb(img)
-		write_image_imageio(file, img, quality)
+			img = unmultiply(np.array(img))
+		# Looking up all channels keeps the output contiguous, alpha is quantized linearly afterwards
+		out = linear_to_srgb_lut(img, out=np.empty(img.shape, dtype=np.uint8))
+		if img.shape[2] == 4:
+			out[...,3] = np.clip(img[...,3], 0.0, 1.0) * 255.0 + 0.5
+		write_image_imageio(file, out, quality)
 
 def trim(error, skip=0.000001):
 	error = np.sort(error.flatten())
@@ -12,45 +12,9 @@ from .common import *
 from .scenes import *
 
 from tqdm import tqdm
-
-
-class InstantNGPPredictOptions:
-    def __init__(self, training_data, root_dir, load_snapshot=None, save_snapshot=None, network_config_path=None, n_steps=-1, files="",
-                 near_distance=-1, exposure=0.0, sharpening=0.0, save_mesh=".", marching_cubes_res=256,
-                 marching_cubes_thresh=2.5, gui=True, width=1920, height=1080):
-        """
-        :param gui: whether to open gui or not
-        :param width: width of gui window
-        :param height: height of gui window
-        :param load_snapshot: path to load snapshot from
-        :param save_snapshot: path to save snapshot to
-        :param network_config_path: path of the network config
-        :param n_steps: number of steps before training stops
-        :param files: Files to be loaded. Can be a scene, network config, snapshot, camera path, or a combination of those.
-        :param training_data: The scene to load. Can be the scene's name or a full path to the training data. Can be NeRF dataset, a *.obj/*.stl mesh for training a SDF, an image, or a *.nvdb volume.
-        :param exposure: Controls the brightness of the image. Positive numbers increase brightness, negative numbers decrease it.
-        :param near_distance: Set the distance from the camera at which training rays start for nerf. <0 means use ngp default
-        :param sharpening: Set amount of sharpening applied to NeRF training images. Range 0.0 to 1.0.
-        :param save_mesh: Output a marching-cubes based mesh from the NeRF or SDF model. Supports OBJ and PLY format.
-        :param marching_cubes_res: Sets the resolution for the marching cubes grid.
-        :param marching_cubes_thresh: Sets the density threshold for marching cubes.
-        """
-        self.load_snapshot = load_snapshot
-        self.save_snapshot = save_snapshot
-        self.network_config_path = network_config_path
-        self.n_steps = n_steps
-        self.files = files
-        self.root_dir = root_dir
-        self.training_data = training_data
-        self.near_distance = near_distance
-        self.exposure = exposure
-        self.sharpen = sharpening
-        self.save_mesh = save_mesh
-        self.marching_cubes_res = marching_cubes_res
-        self.marchines_cubes_thresh = marching_cubes_thresh
-        self.width = width
-        self.height = height
-        self.gui = gui
+from src.metrics import REGISTRY
+# Kept apart so the options can be built without importing pyngp
+from .instant_ngp_options import InstantNGPPredictOptions
 
 
 class InstantNGP:
@@ -79,7 +43,10 @@ class InstantNGP:
         testbed.load_snapshot(snapshot)
         repl(testbed)
 
-    def predict(self, opts: InstantNGPPredictOptions):
+    def predict(self, opts: InstantNGPPredictOptions, progress=None):
+        """
+        :param progress: Optional callable progress(event, **data) that receives the training step, loss and speed
+        """
         testbed = ngp.Testbed()
         testbed.root_dir = opts.root_dir
         if opts.training_data:
@@ -153,8 +120,11 @@ class InstantNGP:
             n_steps = 150000
 
         tqdm_last_update = 0
+        progress_step = 0
+        progress_time = time.monotonic()
         if n_steps > 0:
-            with tqdm(desc="Training", total=n_steps, unit="steps") as t:
+            with REGISTRY.timed('training', 'Duration of the instant-ngp training loop'), \
+                    tqdm(desc="Training", total=n_steps, unit="steps") as t:
                 while testbed.frame():
                     if testbed.want_repl():
                         repl(testbed)
@@ -176,6 +146,15 @@ class InstantNGP:
                         t.set_postfix(loss=testbed.loss)
                         old_training_step = testbed.training_step
                         tqdm_last_update = now
+                        if progress is not None and now - progress_time > 1.0:
+                            steps_per_sec = max(0, testbed.training_step - progress_step) / (now - progress_time)
+                            progress('training', step=testbed.training_step, total=n_steps, loss=testbed.loss,
+                                     steps_per_sec=steps_per_sec)
+                            progress_step = testbed.training_step
+                            progress_time = now
+
+        if progress is not None and n_steps > 0:
+            progress('training', step=testbed.training_step, total=n_steps, loss=testbed.loss, final=True)
 
         if opts.save_snapshot:
             os.makedirs(os.path.dirname(opts.save_snapshot), exist_ok=True)
@@ -246,5 +225,8 @@ class InstantNGP:
             thresh = opts.marchines_cubes_thresh or 2.5
             print(
                 f"Generating mesh via marching cubes and saving to {opts.save_mesh}. Resolution=[{res},{res},{res}], Density Threshold={thresh}")
-            testbed.compute_and_save_marching_cubes_mesh(opts.save_mesh, [res, res, res], thresh=thresh)
+            if progress is not None:
+                progress('stage', stage='marching_cubes')
+            with REGISTRY.timed('marching_cubes', 'Duration of the mesh extraction'):
+                testbed.compute_and_save_marching_cubes_mesh(opts.save_mesh, [res, res, res], thresh=thresh)
 
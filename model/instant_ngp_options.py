@@ -0,0 +1,50 @@
+class InstantNGPPredictOptions:
+    def __init__(self, training_data, root_dir, load_snapshot=None, save_snapshot=None, network_config_path=None, n_steps=-1, files="",
+                 near_distance=-1, exposure=0.0, sharpening=0.0, save_mesh=".", marching_cubes_res=256,
+                 marching_cubes_thresh=2.5, gui=True, width=1920, height=1080):
+        """
+        :param gui: whether to open gui or not
+        :param width: width of gui window
+        :param height: height of gui window
+        :param load_snapshot: path to load snapshot from
+        :param save_snapshot: path to save snapshot to
+        :param network_config_path: path of the network config
+        :param n_steps: number of steps before training stops
+        :param files: Files to be loaded. Can be a scene, network config, snapshot, camera path, or a combination of those.
+        :param training_data: The scene to load. Can be the scene's name or a full path to the training data. Can be NeRF dataset, a *.obj/*.stl mesh for training a SDF, an image, or a *.nvdb volume.
+        :param exposure: Controls the brightness of the image. Positive numbers increase brightness, negative numbers decrease it.
+        :param near_distance: Set the distance from the camera at which training rays start for nerf. <0 means use ngp default
+        :param sharpening: Set amount of sharpening applied to NeRF training images. Range 0.0 to 1.0.
+        :param save_mesh: Output a marching-cubes based mesh from the NeRF or SDF model. Supports OBJ and PLY format.
+        :param marching_cubes_res: Sets the resolution for the marching cubes grid.
+        :param marching_cubes_thresh: Sets the density threshold for marching cubes.
+        """
+        self.load_snapshot = load_snapshot
+        self.save_snapshot = save_snapshot
+        self.network_config_path = network_config_path
+        self.n_steps = n_steps
+        self.files = files
+        self.root_dir = root_dir
+        self.training_data = training_data
+        self.near_distance = near_distance
+        self.exposure = exposure
+        self.sharpen = sharpening
+        self.save_mesh = save_mesh
+        self.marching_cubes_res = marching_cubes_res
+        self.marchines_cubes_thresh = marching_cubes_thresh
+        self.width = width
+        self.height = height
+        self.gui = gui
+
+    def training_params(self):
+        """
+        :return: A dict of the options that change the trained model and the extracted mesh, paths and gui settings
+        are left out
+        """
+        return {'network_config_path': self.network_config_path,
+                'n_steps': self.n_steps,
+                'near_distance': self.near_distance,
+                'exposure': self.exposure,
+                'sharpen': self.sharpen,
+                'marching_cubes_res': self.marching_cubes_res,
+                'marching_cubes_thresh': self.marchines_cubes_thresh}
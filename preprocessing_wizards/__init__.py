@@ -1,8 +1,26 @@
-from .color_augmentation import ColorAugmentation
-#from .exponential_downscaling import ExponentialDownScaling
+import importlib
+
 from .preprocessing_wizard import PPWizard
-from .augmentation import Augmentation
-from .white_balancing import WhiteBalancing
-from .clahe import CLAHE
-from .filter import Filtering
-from .resize import Resizing
+
+# Wizards are imported on first access since some of them pull in torchvision
+_WIZARD_MODULES = {'ColorAugmentation': '.color_augmentation',
+                   'ExponentialDownScaling': '.exponential_downscaling',
+                   'Augmentation': '.augmentation',
+                   'WhiteBalancing': '.white_balancing',
+                   'CLAHE': '.clahe',
+                   'Filtering': '.filter',
+                   'Resizing': '.resize',
+                   'GammaCorrection': '.gamma',
+                   'PreprocessingExecutor': '.executor',
+                   'PreprocessCache': '.cache',
+                   'PreprocessResult': '.executor'}
+
+__all__ = ['PPWizard'] + list(_WIZARD_MODULES)
+
+
+def __getattr__(name):
+    if name not in _WIZARD_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_WIZARD_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,26 +1,113 @@
 from .preprocessing_wizard import PPWizard
-import tensorflow as tf
-from keras._tf_keras.keras.preprocessing.image import ImageDataGenerator
+import zlib
+import cv2
+import numpy as np
+
+BORDER_MODES = {'nearest': cv2.BORDER_REPLICATE, 'reflect': cv2.BORDER_REFLECT, 'wrap': cv2.BORDER_WRAP,
+                'constant': cv2.BORDER_CONSTANT}
 
 
 class Augmentation(PPWizard):
-    def __init__(self):
+    # Produces copies outputs per image, and random ones unless seeded
+    cacheable = False
+
+    def __init__(self, rotation_range=20, width_shift_range=0.2, height_shift_range=0.2, shear_range=0.2,
+                 zoom_range=0.2, horizontal_flip=True, vertical_flip=True, fill_mode='nearest', copies=1,
+                 keep_original=False, seed=None):
+        """
+        Random affine warps with the parameters of Keras' ImageDataGenerator
+        :param rotation_range: Maximum rotation in degrees
+        :param width_shift_range: Maximum horizontal shift as a fraction of the width
+        :param height_shift_range: Maximum vertical shift as a fraction of the height
+        :param shear_range: Maximum shear angle in degrees
+        :param zoom_range: Zoom is drawn from [1 - zoom_range, 1 + zoom_range] per axis
+        :param fill_mode: How pixels outside the image are filled, 'nearest', 'reflect', 'wrap' or 'constant'
+        :param copies: Number of augmented images produced per image
+        :param keep_original: Output the unchanged image before its augmented copies
+        :param seed: Makes the augmentation of every image reproducible, the random state is derived from the seed and
+        the image content so it does not depend on the order or the process images are augmented in
+        """
         super().__init__()
+        if fill_mode not in BORDER_MODES:
+            raise ValueError(f'Unknown fill mode {fill_mode!r}')
+        self.rotation_range = rotation_range
+        self.width_shift_range = width_shift_range
+        self.height_shift_range = height_shift_range
+        self.shear_range = shear_range
+        self.zoom_range = zoom_range
+        self.horizontal_flip = horizontal_flip
+        self.vertical_flip = vertical_flip
+        self.fill_mode = fill_mode
+        self.copies = copies
+        self.keep_original = keep_original
+        self.seed = seed
+
+    def _rng(self, image):
+        if self.seed is None:
+            return np.random.default_rng()
+        return np.random.default_rng([self.seed, zlib.crc32(np.ascontiguousarray(image))])
+
+    def transforms(self, rng, count, shape):
+        """
+        Draws count random warps for images of the given shape
+        :return: A (count, 2, 3) array of affine matrices and two (count,) boolean arrays of horizontal and vertical
+        flips
+        """
+        height, width = shape[:2]
+        theta = np.deg2rad(rng.uniform(-self.rotation_range, self.rotation_range, count))
+        tx = rng.uniform(-self.width_shift_range, self.width_shift_range, count) * width
+        ty = rng.uniform(-self.height_shift_range, self.height_shift_range, count) * height
+        shear = np.deg2rad(rng.uniform(-self.shear_range, self.shear_range, count))
+        zx, zy = rng.uniform(1 - self.zoom_range, 1 + self.zoom_range, (2, count))
+        flip_h = rng.random(count) < 0.5 if self.horizontal_flip else np.zeros(count, dtype=bool)
+        flip_v = rng.random(count) < 0.5 if self.vertical_flip else np.zeros(count, dtype=bool)
+
+        cos, sin = np.cos(theta), np.sin(theta)
+        # Rotation @ shear @ zoom, the linear part of every warp
+        linear = np.empty((count, 2, 2))
+        linear[:, 0, 0] = cos * zx
+        linear[:, 0, 1] = (-sin - cos * np.tan(shear)) * zy
+        linear[:, 1, 0] = sin * zx
+        linear[:, 1, 1] = (cos - sin * np.tan(shear)) * zy
+        # Warp around the image center, then shift
+        center = np.array([(width - 1) / 2, (height - 1) / 2])
+        matrices = np.empty((count, 2, 3))
+        matrices[:, :, :2] = linear
+        matrices[:, :, 2] = center - linear @ center + np.stack([tx, ty], axis=1)
+        return matrices, flip_h, flip_v
+
+    def _augment(self, image, matrix, flip_h, flip_v, dst=None):
+        height, width = image.shape[:2]
+        warped = cv2.warpAffine(image, matrix, (width, height), dst=dst, flags=cv2.INTER_LINEAR,
+                                borderMode=BORDER_MODES[self.fill_mode])
+        if flip_h and flip_v:
+            return cv2.flip(warped, -1, dst=warped)
+        if flip_h or flip_v:
+            return cv2.flip(warped, 1 if flip_h else 0, dst=warped)
+        return warped
 
     def preprocess(self, dataset):
-        data = []
-        data_generator = ImageDataGenerator(
-            rotation_range=20,
-            width_shift_range=0.2,
-            height_shift_range=0.2,
-            shear_range=0.2,
-            zoom_range=0.2,
-            horizontal_flip=True,
-            vertical_flip=True,
-            fill_mode='nearest'
-        )
-        for image in dataset:
-            img = image.reshape((1,) + image.shape)
-            augmented_images = data_generator.flow(img, batch_size=1)
-            data.append(augmented_images.__getitem__(0))
-        return data
+        return list(self.stream(dataset))
+
+    def stream(self, items):
+        for image in items:
+            if self.keep_original:
+                yield image
+            matrices, flip_h, flip_v = self.transforms(self._rng(image), self.copies, image.shape)
+            for k in range(self.copies):
+                yield self._augment(image, matrices[k], flip_h[k], flip_v[k])
+
+    def preprocess_batch(self, batch, out=None):
+        # The outputs of every image are consecutive, with the original first when it is kept
+        per_image = self.copies + int(self.keep_original)
+        if out is None:
+            out = np.empty((len(batch) * per_image,) + batch.shape[1:], dtype=batch.dtype)
+        for i, image in enumerate(batch):
+            first = i * per_image
+            if self.keep_original:
+                out[first] = image
+                first += 1
+            matrices, flip_h, flip_v = self.transforms(self._rng(image), self.copies, image.shape)
+            for k in range(self.copies):
+                self._augment(image, matrices[k], flip_h[k], flip_v[k], dst=out[first + k])
+        return out
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+
+class PreprocessCache:
+    def __init__(self, root, quota_bytes):
+        """
+        On disk store of the images produced by every prefix of a preprocessing pipeline, keyed by the hash of the
+        source image and the fingerprints of the wizards run on it. Entries are written by the worker processes and
+        the least recently used ones are evicted once the cache grows past its quota
+        :param root: Directory holding the cached images as .npy files
+        :param quota_bytes: Maximum size of the cache on disk, 0 disables caching
+        """
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        if self.quota_bytes:
+            os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def keys(source_digest, pipeline):
+        """
+        :param source_digest: sha256 digest of the encoded source image
+        :param pipeline: The list of PPWizards run on the image
+        :return: The key of the output of every pipeline prefix up to the first wizard that is not cacheable
+        """
+        keys = []
+        digest = hashlib.sha256(source_digest.encode('utf-8'))
+        for wizard in pipeline:
+            if not wizard.cacheable:
+                break
+            digest.update(wizard.fingerprint().encode('utf-8'))
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.npy')
+
+    def get(self, key):
+        """
+        :return: The cached image, or None on a miss
+        """
+        if not self.quota_bytes:
+            return None
+        path = self._path(key)
+        try:
+            image = np.load(path, allow_pickle=False)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, or evicted while it was read
+            return None
+        return image
+
+    def put(self, key, image):
+        """
+        :return: Number of bytes written
+        """
+        if not self.quota_bytes:
+            return 0
+        path = self._path(key)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(path), f'.{key}.{uuid.uuid4().hex}.npy')
+        np.save(tmp, image, allow_pickle=False)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def evict(self):
+        """
+        Removes the least recently used images until the cache fits in its quota, only one process should evict
+        """
+        if not self.quota_bytes or not os.path.isdir(self.root):
+            return
+        entries = []
+        total = 0
+        for shard in os.listdir(self.root):
+            folder = os.path.join(self.root, shard)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        for last_used, size, path in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
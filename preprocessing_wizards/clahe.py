@@ -1,17 +1,64 @@
 from .preprocessing_wizard import PPWizard
+import threading
 import cv2
+import numpy as np
+
+# Conversions to a color space with a luminance channel and back, with the index of that channel
+COLOR_SPACES = {'lab': (cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR, 0),
+                'ycrcb': (cv2.COLOR_BGR2YCrCb, cv2.COLOR_YCrCb2BGR, 0)}
+
+# OpenCV CLAHE objects of every thread by parameters. Workers unpickle a new wizard for every image, so the objects
+# are kept per process instead of per wizard
+_CLAHES = threading.local()
+
 
 class CLAHE(PPWizard):
-    def __init__(self, cliplimit, gridsize):
+    def __init__(self, cliplimit, gridsize, mode='lab'):
+        """
+        :param mode: 'lab' or 'ycrcb' equalize the luminance channel of that color space and keep the colors, 'gray'
+        equalizes the grayscale image and returns it as three identical channels
+        """
         super().__init__()
+        if mode not in COLOR_SPACES and mode != 'gray':
+            raise ValueError(f'Unknown CLAHE mode {mode!r}')
         self.cliplimit = cliplimit
         self.gridsize = gridsize
+        self.mode = mode
+
+    @property
+    def clahe(self):
+        """
+        The OpenCV CLAHE object of the calling thread for these parameters, created on first use and reused for every
+        image
+        """
+        objects = getattr(_CLAHES, 'objects', None)
+        if objects is None:
+            objects = _CLAHES.objects = {}
+        key = (self.cliplimit, tuple(self.gridsize))
+        clahe = objects.get(key)
+        if clahe is None:
+            clahe = objects[key] = cv2.createCLAHE(clipLimit=self.cliplimit, tileGridSize=key[1])
+        return clahe
+
+    def _equalize(self, img, dst=None):
+        if self.mode == 'gray' or img.ndim == 2:
+            gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            return cv2.cvtColor(self.clahe.apply(gray), cv2.COLOR_GRAY2RGB, dst=dst)
+        forward, backward, channel = COLOR_SPACES[self.mode]
+        converted = cv2.cvtColor(img, forward)
+        luminance = cv2.extractChannel(converted, channel)
+        cv2.insertChannel(self.clahe.apply(luminance), converted, channel)
+        return cv2.cvtColor(converted, backward, dst=dst)
 
     def preprocess(self, dataset):
         data = []
         for img in dataset:
-            clahe = cv2.createCLAHE(clipLimit=self.cliplimit, tileGridSize=self.gridsize)
-            cl1 = clahe.apply(img)
-            cl1 = cv2.cvtColor(cl1, cv2.COLOR_GRAY2RGB)
-            data.append(cl1)
-        return data
\ No newline at end of file
+            data.append(self._equalize(img))
+        return data
+
+    def preprocess_batch(self, batch, out=None):
+        if out is None:
+            out = np.empty(batch.shape[:3] + (3,), dtype=batch.dtype)
+        for img, dst in zip(batch, out):
+            self._equalize(img, dst=dst)
+        return out
@@ -3,10 +3,17 @@ from torchvision import transforms
 
 
 class ColorAugmentation(PPWizard):
+    # Random, every run has to produce new colors
+    cacheable = False
+
     def __init__(self, brightness, contrast, saturation, hue):
         super().__init__()
-        self.color_aug = transforms.ColorJitter(brightness=brightness, contrast=contrast,
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self._color_aug = transforms.ColorJitter(brightness=brightness, contrast=contrast,
                                                            saturation=saturation, hue=hue)
 
     def preprocess(self, data):
-        return [self.color_aug(img) for img in data]
+        return [self._color_aug(img) for img in data]
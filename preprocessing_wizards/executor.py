@@ -0,0 +1,221 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from .preprocessing_wizard import PPWizard
+from src.metrics import REGISTRY
+
+
+class PreprocessResult:
+    def __init__(self, path, error=None, timings=None):
+        """
+        :param path: Path of the image, the preprocessed output replaces it
+        :param error: Message describing why the image could not be preprocessed, None on success
+        :param timings: Seconds spent decoding, in every wizard and encoding
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.error = error
+        self.timings = timings or {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def preprocess_file(path, pipeline, cache=None, image=None, store=None):
+    """
+    Runs the pipeline on a single image file and overwrites it with the result, executed inside the worker processes.
+    Outputs are written as soon as the pipeline yields them, the first one replaces the image and every further one
+    is written next to it as {stem}_{k}{ext}
+    :param cache: Optional PreprocessCache, the longest cached prefix of the pipeline is skipped and the output of
+    every cacheable wizard that had to run is stored
+    :param image: An already decoded image, e.g. a video frame, that is preprocessed and written to path instead of
+    reading path
+    :param store: Optional ImageStore the outputs are put in decoded under the name of their file, instead of
+    encoding them. The source file is removed once its output is stored, so only exports of the store end up there
+    :return: A dict of the seconds spent per step
+    """
+    timings = {'wizards': [], 'encode': 0.0, 'skipped': 0, 'cached_bytes': 0}
+    # Fused up front so pointwise runs are also cached as one stage
+    pipeline = PPWizard.fuse(pipeline)
+    tic = time.perf_counter()
+    if image is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data)
+    else:
+        data = None
+        digest = hashlib.sha256(np.ascontiguousarray(image))
+    keys = cache.keys(digest.hexdigest(), pipeline) if cache is not None else []
+    img = None
+    start = 0
+    for i in reversed(range(len(keys))):
+        img = cache.get(keys[i])
+        if img is not None:
+            start = timings['skipped'] = i + 1
+            break
+    if img is None and image is not None:
+        img = image
+    elif img is None:
+        img = (pipeline[0] if pipeline else PPWizard()).decode(np.frombuffer(data, np.uint8))
+        if img is None:
+            raise ValueError(f'Could not decode {path}')
+    del data, image
+    timings['decode'] = time.perf_counter() - tic
+    for i in range(start, len(keys)):
+        img = PPWizard.run_pipeline(img, pipeline[i:i + 1], timings=timings['wizards'])[0]
+        timings['cached_bytes'] += cache.put(keys[i], img)
+    stem, ext = os.path.splitext(path)
+    outputs = PPWizard.run_pipeline_stream([img], pipeline[len(keys):], timings=timings['wizards'])
+    del img
+    for k, output in enumerate(outputs):
+        target = path if k == 0 else f'{stem}_{k}{ext}'
+        tic = time.perf_counter()
+        if store is not None:
+            store.put(os.path.basename(target), output)
+            if target == path and os.path.exists(path):
+                os.remove(path)
+        elif not cv2.imwrite(target, output):
+            raise ValueError(f'Could not encode {target}')
+        timings['encode'] += time.perf_counter() - tic
+    return timings
+
+
+class PreprocessingExecutor:
+    def __init__(self, workers=None, max_in_flight=None, cache=None):
+        """
+        Preprocesses image files on a pool of processes, at most max_in_flight images are decoded at once so memory
+        stays bounded however many images are submitted
+        :param workers: Number of worker processes, defaults to the number of cores
+        :param max_in_flight: Number of images submitted to the pool before submit blocks, defaults to twice the
+        number of workers
+        :param cache: Optional PreprocessCache the workers read and write the outputs of the wizards to
+        """
+        self.workers = workers or os.cpu_count()
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.cache = cache
+        self._pool = None
+        self._lock = threading.Lock()
+        self._written = 0
+
+    def _get_pool(self, broken=None):
+        with self._lock:
+            if self._pool is None or self._pool is broken:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context())
+            return self._pool
+
+    def submit(self, path, pipeline, image=None, store=None):
+        """
+        Blocks while max_in_flight images are being processed
+        :param image: Optional decoded image that is preprocessed and written to path instead of reading path
+        :param store: Optional ImageStore the outputs are kept in decoded instead of being encoded
+        :return: A Future resolving to a PreprocessResult, failures are reported in the result instead of raised
+        """
+        self._slots.acquire()
+        try:
+            pool = self._get_pool()
+            try:
+                future = pool.submit(preprocess_file, path, pipeline, self.cache, image, store)
+            except BrokenProcessPool:
+                # A worker died, e.g. killed for memory, replace the pool once
+                future = self._get_pool(broken=pool).submit(preprocess_file, path, pipeline, self.cache, image,
+                                                            store)
+        except BaseException:
+            self._slots.release()
+            raise
+        result = Future()
+        future.add_done_callback(lambda f: self._complete(f, path, result))
+        result.add_done_callback(lambda r: self._cancel(r, future))
+        return result
+
+    @staticmethod
+    def _cancel(result, future):
+        # Cancelling the result also drops the image from the pool when it did not start yet
+        if result.cancelled():
+            future.cancel()
+
+    def _complete(self, future, path, result):
+        self._slots.release()
+        if not result.set_running_or_notify_cancel():
+            return
+        try:
+            timings = future.result()
+            _record(timings)
+            self._evict(timings['cached_bytes'])
+            result.set_result(PreprocessResult(path, timings=timings))
+        except Exception as e:
+            REGISTRY.inc('image_preprocessing_errors_total', description='Images that could not be preprocessed')
+            result.set_result(PreprocessResult(path, error=str(e) or type(e).__name__))
+
+    def _evict(self, written):
+        # Scanning the cache is not free, so it only happens after a tenth of the quota was written
+        if self.cache is None or not written:
+            return
+        with self._lock:
+            self._written += written
+            if self._written < self.cache.quota_bytes // 10:
+                return
+            self._written = 0
+        self.cache.evict()
+
+    def map(self, paths, pipeline, progress=None, store=None):
+        """
+        :param paths: Image files to preprocess in place
+        :param progress: Optional callable progress(event, **data) notified after every image
+        :param store: Optional ImageStore the outputs are kept in decoded instead of being encoded
+        :return: A list of PreprocessResult in the order of paths
+        """
+        paths = list(paths)
+        done = []
+        lock = threading.Lock()
+
+        def on_done(future):
+            with lock:
+                done.append(future)
+                count = len(done)
+            progress('preprocessing', done=count, total=len(paths), final=count == len(paths))
+
+        futures = []
+        for path in paths:
+            future = self.submit(path, pipeline, store=store)
+            if progress is not None:
+                future.add_done_callback(on_done)
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def _worker_context():
+    # The pool is created from a request thread, forking the server would copy locks other threads hold. Workers are
+    # forked from a server process that only imported this module instead
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _record(timings):
+    REGISTRY.observe('image_decode_seconds', timings['decode'], 'Duration of decoding an input image')
+    for name, seconds in timings['wizards']:
+        REGISTRY.observe('wizard_seconds', seconds, 'Duration of a preprocessing wizard', wizard=name)
+    REGISTRY.observe('image_encode_seconds', timings['encode'], 'Duration of encoding a preprocessed image')
+    REGISTRY.inc('images_preprocessed_total', description='Number of preprocessed images')
+    if timings['skipped']:
+        REGISTRY.inc('preprocess_cache_skipped_wizards_total', timings['skipped'],
+                     description='Wizard runs skipped because their output was cached')
+
@@ -4,18 +4,28 @@ from PIL import Image
 
 
 class ExponentialDownScaling(PPWizard):
+    # Produces num_scales outputs per image
+    cacheable = False
 
     def __init__(self, width, height, num_scales=4, interpolation: transforms.InterpolationMode = Image.ANTIALIAS):
         super().__init__()
+        self.width = width
+        self.height = height
         self.num_scales = num_scales
-        self.resize = []
+        self.interpolation = interpolation
+        self._resize = []
         for i in range(self.num_scales):
             s = 2 ** i
-            self.resize.append(transforms.Compose([transforms.ToPILImage(), transforms.Resize((width // s, height // s), interpolation=interpolation),transforms.ToTensor()]))
+            self._resize.append(transforms.Compose([transforms.ToPILImage(), transforms.Resize((width // s, height // s), interpolation=interpolation),transforms.ToTensor()]))
 
     def preprocess(self, data):
         output = []
         for item in data:
-            for i in range(len(self.resize)):
-                output.append(self.resize[i](item))
+            for i in range(len(self._resize)):
+                output.append(self._resize[i](item))
         return output
+
+    def stream(self, items):
+        for item in items:
+            for resize in self._resize:
+                yield resize(item)
@@ -1,17 +1,56 @@
 from .preprocessing_wizard import PPWizard
 import cv2
+import numpy as np
 
 
 class Filtering(PPWizard):
-    def __init__(self, D=9, color=75, space=75):
+    def __init__(self, D=9, color=75, space=75, mode='exact', quality=0.5):
+        """
+        :param mode: 'exact' runs the bilateral filter, 'approximate' runs a guided filter with the image as its own
+        guide on a downscaled copy and upsamples its coefficients, which preserves edges the same way at a fraction of
+        the cost
+        :param quality: Scale of the copy the approximate filter runs on, in (0, 1], lower is faster
+        """
         super().__init__()
+        if mode not in ('exact', 'approximate'):
+            raise ValueError(f'Unknown filtering mode {mode!r}')
+        if not 0 < quality <= 1:
+            raise ValueError(f'quality must be in (0, 1], got {quality}')
         self.D = D
         self.color = color
         self.space = space
+        self.mode = mode
+        self.quality = quality
+
+    def guided_filter(self, img):
+        height, width = img.shape[:2]
+        scale = self.quality
+        small = img if scale == 1 else cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        small = small.astype(np.float32)
+        diameter = self.D if self.D > 0 else 2 * round(1.5 * self.space) + 1
+        # A box of half the bilateral diameter and a regularization of half sigmaColor matched the bilateral filter best
+        radius = max(1, round(diameter / 4 * scale))
+        box = (2 * radius + 1, 2 * radius + 1)
+        eps = (self.color / 2) ** 2 * scale
+        mean = cv2.boxFilter(small, -1, box)
+        variance = cv2.boxFilter(small * small, -1, box) - mean * mean
+        a = variance / (variance + eps)
+        b = mean - a * mean + 0.5
+        a = cv2.boxFilter(a, -1, box)
+        b = cv2.boxFilter(b, -1, box)
+        if scale != 1:
+            a = cv2.resize(a, (width, height), interpolation=cv2.INTER_LINEAR)
+            b = cv2.resize(b, (width, height), interpolation=cv2.INTER_LINEAR)
+        filtered = cv2.multiply(a, img, dtype=cv2.CV_32F)
+        cv2.add(filtered, b, dst=filtered)
+        return np.clip(filtered, 0, 255, out=filtered).astype(img.dtype)
 
     def preprocess(self, dataset):
         data = []
         for img in dataset:
-            filteredImage = cv2.bilateralFilter(img, d=self.D, sigmaColor=self.color, sigmaSpace=self.space)
+            if self.mode == 'approximate':
+                filteredImage = self.guided_filter(img)
+            else:
+                filteredImage = cv2.bilateralFilter(img, d=self.D, sigmaColor=self.color, sigmaSpace=self.space)
             data.append(filteredImage)
         return data
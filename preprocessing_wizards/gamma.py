@@ -0,0 +1,27 @@
+from .preprocessing_wizard import PPWizard
+import cv2
+import numpy as np
+
+
+class GammaCorrection(PPWizard):
+    pointwise = True
+
+    def __init__(self, gamma=1.0):
+        """
+        Maps every value v in [0, 1] to v ** gamma, below 1 brightens and above 1 darkens the image
+        """
+        super().__init__()
+        self.gamma = gamma
+
+    def point_lut(self, histograms=None):
+        values = np.arange(256, dtype=np.float64) / 255
+        return np.clip(np.rint(values ** self.gamma * 255), 0, 255).astype(np.uint8)[:, None]
+
+    def preprocess(self, dataset):
+        data = []
+        for img in dataset:
+            if img.dtype == np.uint8:
+                data.append(cv2.LUT(img, self.point_lut()[:, 0]))
+            else:
+                data.append(np.clip(img, 0, 1) ** self.gamma)
+        return data
@@ -1,7 +1,85 @@
+import hashlib
+import json
+import time
+
+import cv2
+import numpy as np
+
+_END = object()
+
+
+def channel_histogram(image, channel):
+    """
+    :return: The 256 bin histogram of a channel of a uint8 image as int64 counts
+    """
+    # calcHist counts in float32, which is only exact below 2**24 pixels, so larger images are counted in blocks of rows
+    rows = max(1, 2 ** 24 // image.shape[1])
+    histogram = np.zeros(256, dtype=np.int64)
+    for start in range(0, image.shape[0], rows):
+        counts = cv2.calcHist([image[start:start + rows]], [channel], None, [256], [0, 256])
+        histogram += counts.ravel().astype(np.int64)
+    return histogram
+
+
 class PPWizard:
+    # Whether the output only depends on the input image and params, and is a single image that may be cached
+    cacheable = True
+    # Whether every output value only depends on the input value of the same channel, such wizards implement
+    # point_lut and consecutive ones are fused into a single lookup table pass
+    pointwise = False
+    # Whether point_lut needs the histograms of the image it is applied to
+    uses_histogram = False
+
     def __init__(self):
         pass
 
+    def params(self):
+        """
+        Objects created from the parameters, such as transforms, are kept in underscore attributes so they are left
+        out and the fingerprint stays the same across processes and runs
+        :return: A dict of the public parameters that change the output of the wizard
+        """
+        return {k: v for k, v in vars(self).items() if not k.startswith('_')}
+
+    @property
+    def name(self):
+        """
+        Name of the wizard in timings and metrics
+        """
+        return type(self).__name__
+
+    def point_lut(self, histograms):
+        """
+        Lookup table of a pointwise wizard for uint8 images
+        :param histograms: A (C, 256) array of the channel histograms of the input, only given when uses_histogram
+        :return: A (256, C) uint8 array mapping every value of each channel to its output value, a single column
+        applies to every channel. None for wizards that are not pointwise
+        """
+        return None
+
+    def configure(self, **options):
+        """
+        :param options: Parameters to change, named like the arguments of the constructor
+        :return: A new wizard of the same class with the given parameters replaced
+        """
+        return type(self)(**{**self.params(), **options})
+
+    def fingerprint(self):
+        """
+        :return: A hex digest identifying the wizard class and its parameters
+        """
+        description = json.dumps([type(self).__name__, self.params()], sort_keys=True, default=repr)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def decode(self, data):
+        """
+        Decodes the source image when the wizard is the first of a pipeline, wizards that do not need the full
+        resolution override this to decode less
+        :param data: A uint8 array of the encoded image file
+        :return: The BGR image, or None when it can not be decoded
+        """
+        return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
     def preprocess(self, data):
         """
         :param data: an array of images
@@ -9,16 +87,191 @@ class PPWizard:
         """
         pass
 
+    def preprocess_batch(self, batch, out=None):
+        """
+        Wizards that can process a whole stack at once override this, the default runs preprocess on every image
+        :param batch: An (N, H, W, C) uint8 array of images with the same size
+        :param out: Optional preallocated array with the shape of the output that the result is written to
+        :return: The array of preprocessed images, out when it is given
+        """
+        data = self.preprocess(list(batch))
+        if out is None:
+            return np.stack(data)
+        for i, img in enumerate(data):
+            out[i] = img
+        return out
+
+    def stream(self, items):
+        """
+        Lazily preprocesses an iterator of images, wizards that produce several outputs per image override this to
+        yield them one at a time
+        :param items: An iterator of images
+        :return: An iterator of preprocessed images
+        """
+        for item in items:
+            yield from self.preprocess([item])
+
+    @staticmethod
+    def fuse(wizard_pipeline):
+        """
+        :return: The pipeline with every run of consecutive pointwise wizards replaced by one FusedPointwise
+        """
+        fused = []
+        group = []
+        for wizard in list(wizard_pipeline) + [None]:
+            if wizard is not None and wizard.pointwise:
+                group.append(wizard)
+                continue
+            if len(group) > 1:
+                fused.append(FusedPointwise(group))
+            else:
+                fused.extend(group)
+            group = []
+            if wizard is not None:
+                fused.append(wizard)
+        return fused
+
     @staticmethod
-    def run_pipeline(item, wizard_pipeline):
+    def run_pipeline(item, wizard_pipeline, timings=None):
         """
         :param wizard_pipeline: A list of PPWizards that are run in ascending order according to index, where the output
         of the first item is given to the second item, etc...
         :param item: the item that is given to the first element in the pipeline
+        :param timings: Optional list that receives a (wizard class name, seconds) tuple per wizard
         :return: The item after being modified by the pipeline
         """
 
         curr_item = [item]
-        for wizard in wizard_pipeline:
+        for wizard in PPWizard.fuse(wizard_pipeline):
+            tic = time.perf_counter()
             curr_item = wizard.preprocess(curr_item)
+            if timings is not None:
+                timings.append((wizard.name, time.perf_counter() - tic))
         return curr_item
+
+    @staticmethod
+    def run_pipeline_batch(batch, wizard_pipeline, out=None, timings=None):
+        """
+        Batched counterpart of run_pipeline
+        :param batch: An (N, H, W, C) uint8 array of images with the same size
+        :param out: Optional preallocated array the last wizard writes its output to
+        :param timings: Optional list that receives a (wizard class name, seconds) tuple per wizard
+        :return: The array of preprocessed images
+        """
+        curr_batch = batch
+        wizard_pipeline = PPWizard.fuse(wizard_pipeline)
+        for i, wizard in enumerate(wizard_pipeline):
+            tic = time.perf_counter()
+            curr_batch = wizard.preprocess_batch(curr_batch, out=out if i == len(wizard_pipeline) - 1 else None)
+            if timings is not None:
+                timings.append((wizard.name, time.perf_counter() - tic))
+        return curr_batch
+
+    @staticmethod
+    def run_pipeline_stream(items, wizard_pipeline, timings=None):
+        """
+        Streaming counterpart of run_pipeline, every output is pulled through the whole pipeline before the next one
+        is produced so only about one image per wizard is held in memory however many outputs fan out
+        :param items: An iterable of images given to the first wizard
+        :param timings: Optional list that receives a (wizard class name, seconds) tuple per wizard once the stream is
+        exhausted
+        :return: An iterator of the outputs of the last wizard
+        """
+        stream = iter(items)
+        for wizard in PPWizard.fuse(wizard_pipeline):
+            stream = wizard.stream(stream) if timings is None else _timed_stream(wizard, stream, timings)
+        return stream
+
+
+class FusedPointwise(PPWizard):
+    pointwise = True
+
+    def __init__(self, wizards):
+        """
+        Runs consecutive pointwise wizards as one lookup table, uint8 images are read and written once instead of once
+        per wizard. Other images run through the wizards one after another
+        :param wizards: The pointwise wizards in pipeline order
+        """
+        super().__init__()
+        self._wizards = list(wizards)
+        self.cacheable = all(wizard.cacheable for wizard in self._wizards)
+        self.uses_histogram = any(wizard.uses_histogram for wizard in self._wizards)
+
+    @property
+    def name(self):
+        return '+'.join(wizard.name for wizard in self._wizards)
+
+    def params(self):
+        return {'wizards': [wizard.fingerprint() for wizard in self._wizards]}
+
+    def point_lut(self, histograms):
+        lut = None
+        for wizard in self._wizards:
+            step = wizard.point_lut(histograms if wizard.uses_histogram else None)
+            # Compose, the next table is indexed by the output of the previous ones. Tables with a single column apply
+            # to every channel and broadcast
+            lut = step if lut is None else np.take_along_axis(step, lut.astype(np.intp), axis=0)
+            if histograms is not None:
+                # Histograms of the output of this step, every input count moves to the value it is mapped to
+                histograms = np.stack([np.bincount(step[:, c if step.shape[1] > 1 else 0], weights=histogram,
+                                                   minlength=256) for c, histogram in enumerate(histograms)])
+        return lut
+
+    def _apply_each(self, img, dst=None):
+        for wizard in self._wizards:
+            img = wizard.preprocess([img])[0]
+        if dst is None:
+            return img
+        dst[...] = img
+        return dst
+
+    def _apply(self, img, dst=None):
+        if img.dtype != np.uint8 or (img.ndim == 3 and img.shape[2] > 4):
+            return self._apply_each(img, dst)
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        histograms = np.stack([channel_histogram(img, c) for c in range(channels)]) if self.uses_histogram else None
+        lut = self.point_lut(histograms)
+        if lut.shape[1] == 1:
+            lut = np.repeat(lut, channels, axis=1)
+        elif lut.shape[1] != channels:
+            # Per channel tables of another width would map channels with the table of a different one
+            return self._apply_each(img, dst)
+        return cv2.LUT(img, lut[:, 0] if img.ndim == 2 else lut[None], dst=dst)
+
+    def preprocess(self, data):
+        return [self._apply(img) for img in data]
+
+    def preprocess_batch(self, batch, out=None):
+        if out is None:
+            out = np.empty_like(batch)
+        for img, dst in zip(batch, out):
+            self._apply(img, dst=dst)
+        return out
+
+
+def _timed_stream(wizard, upstream, timings):
+    """
+    Streams through the wizard and records the time spent in it, excluding the time spent in the wizards before it
+    """
+    upstream_seconds = 0.0
+
+    def source():
+        nonlocal upstream_seconds
+        while True:
+            tic = time.perf_counter()
+            item = next(upstream, _END)
+            upstream_seconds += time.perf_counter() - tic
+            if item is _END:
+                return
+            yield item
+
+    seconds = 0.0
+    outputs = wizard.stream(source())
+    while True:
+        tic = time.perf_counter()
+        item = next(outputs, _END)
+        seconds += time.perf_counter() - tic
+        if item is _END:
+            break
+        yield item
+    timings.append((wizard.name, seconds - upstream_seconds))
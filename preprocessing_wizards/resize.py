@@ -1,20 +1,107 @@
 from .preprocessing_wizard import PPWizard
+import struct
 import cv2
+import numpy as np
+
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Start of frame markers, the remaining markers in 0xC0-0xCF are DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_size(data):
+    """
+    Reads the dimensions from the header of a JPEG or PNG file without decoding it
+    :param data: The encoded file, or at least its first few kilobytes
+    :return: A (width, height, format) tuple with format 'jpeg' or 'png', or None for other or truncated files
+    """
+    # Exif segments come before the frame header and are at most 64KB each
+    data = bytes(data[:262144])
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', data[16:24])
+        return width, height, 'png'
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height, 'jpeg'
+        i += 2 + length
+    return None
 
 
 class Resizing(PPWizard):
-    def __init__(self, high=700, low=500):
+    def __init__(self, high=700, low=500, upscale=True, reduced_decode=True):
+        """
+        Resizes landscape images to high x low, portrait images to low x high and square ones to high x high
+        :param upscale: Set to False to keep images that are already smaller than the target as they are
+        :param reduced_decode: Let the JPEG decoder scale the image down by 2, 4 or 8 while decoding when the target
+        is at most that much smaller than the source
+        """
         super().__init__()
         self.high = high
         self.low = low
+        self.upscale = upscale
+        self.reduced_decode = reduced_decode
+
+    def target_size(self, shape):
+        """
+        :param shape: Shape of the image, height first
+        :return: The (width, height) the image is resized to
+        """
+        if shape[0] > shape[1]:
+            return self.low, self.high
+        elif shape[1] > shape[0]:
+            return self.high, self.low
+        return self.high, self.high
+
+    def decode(self, data):
+        size = image_size(data) if self.reduced_decode else None
+        if size is not None and size[2] == 'jpeg':
+            width, height, _ = size
+            target_width, target_height = self.target_size((height, width))
+            for factor, flag in REDUCED_DECODE_FLAGS:
+                if width // factor >= target_width and height // factor >= target_height:
+                    return cv2.imdecode(data, flag)
+        return super().decode(data)
+
+    def _resize(self, img, dst=None):
+        width, height = self.target_size(img.shape)
+        shrinking = width <= img.shape[1] and height <= img.shape[0]
+        if not self.upscale and width >= img.shape[1] and height >= img.shape[0]:
+            if dst is None:
+                return img
+            dst[...] = img
+            return dst
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        return cv2.resize(img, (width, height), dst=dst, interpolation=interpolation)
 
     def preprocess(self, dataset):
         data = []
         for img in dataset:
-            if img.shape[0] > img.shape[1]:
-                data.append(cv2.resize(img, (self.low, self.high)))
-            elif img.shape[1] > img.shape[0]:
-                data.append(cv2.resize(img, (self.high, self.low)))
-            else:
-                data.append((cv2.resize(img, (self.high, self.high))))
+            data.append(self._resize(img))
         return data
+
+    def preprocess_batch(self, batch, out=None):
+        # Every image of the stack has the same size, so the output is allocated once and resized into in place
+        width, height = self.target_size(batch.shape[1:])
+        if not self.upscale and width >= batch.shape[2] and height >= batch.shape[1]:
+            width, height = batch.shape[2], batch.shape[1]
+        if out is None:
+            out = np.empty((len(batch), height, width) + batch.shape[3:], dtype=batch.dtype)
+        for img, dst in zip(batch, out):
+            self._resize(img, dst=dst)
+        return out
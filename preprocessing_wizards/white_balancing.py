@@ -1,17 +1,62 @@
-from .preprocessing_wizard import PPWizard
+from .preprocessing_wizard import PPWizard, channel_histogram
 from skimage.util import img_as_ubyte
+import cv2
 import numpy as np
 
 
+def histogram_percentile(histogram, percentile):
+    """
+    Percentile of the values counted in a histogram with the same linear interpolation as np.percentile
+    :param histogram: Counts of the values 0..len(histogram) - 1
+    """
+    cumulative = np.cumsum(histogram)
+    position = percentile / 100 * (cumulative[-1] - 1)
+    lower = int(np.floor(position))
+    # The k-th smallest value is the first one whose cumulative count exceeds k
+    low, high = np.searchsorted(cumulative, [lower, min(lower + 1, cumulative[-1] - 1)], side='right')
+    return low + (position - lower) * (high - low)
+
+
 class WhiteBalancing(PPWizard):
+    pointwise = True
+    uses_histogram = True
+
     def __init__(self, percentile=100):
+        super().__init__()
         self.percentile = percentile
 
+    def point_lut(self, histograms):
+        """
+        Computes the white point of every channel from 256 bin histograms instead of sorting the pixels
+        :param histograms: A (C, 256) array of the channel histograms of the image
+        :return: A (256, C) lookup table mapping every value of each channel to its white balanced value
+        """
+        white = np.array([histogram_percentile(histogram, self.percentile) for histogram in histograms])
+        # The same arithmetic as the float path applied to every possible value, so both paths agree exactly
+        values = np.arange(256, dtype=np.float64)[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return img_as_ubyte((values / white).clip(0, 1))
+
+    def _balance(self, image, dst=None):
+        if image.dtype != np.uint8 or (image.ndim == 3 and image.shape[2] > 4):
+            balanced = img_as_ubyte((image * 1.0 / np.percentile(image, self.percentile, axis=(0, 1))).clip(0, 1))
+            if dst is None:
+                return balanced
+            dst[...] = balanced
+            return dst
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        lut = self.point_lut(np.stack([channel_histogram(image, c) for c in range(channels)]))
+        return cv2.LUT(image, lut[:, 0] if image.ndim == 2 else lut[None], dst=dst)
+
     def preprocess(self, dataset):
         data = []
         for image in dataset:
-            white_patch_image = img_as_ubyte((image * 1.0 /
-                                                  np.percentile(image, self.percentile,
-                                                                axis=(0, 1))).clip(0, 1))
-            data.append(white_patch_image)
+            data.append(self._balance(image))
         return data
+
+    def preprocess_batch(self, batch, out=None):
+        if out is None:
+            out = np.empty_like(batch)
+        for image, dst in zip(batch, out):
+            self._balance(image, dst=dst)
+        return out
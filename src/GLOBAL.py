@@ -3,4 +3,24 @@ parser = ArgumentParser()
 parser.add_argument("-p", "--port", dest='port', default="5000", type=int)
 parser.add_argument("--host", dest='host', default="127.0.0.1")
 parser.add_argument("--instant_ngp", dest='instant_ngp', required=True)
+parser.add_argument("--workers", dest='workers', default=None, type=int, help="Defaults to max_sfm_jobs + max_training_jobs")
+parser.add_argument("--max_sfm_jobs", dest='max_sfm_jobs', default=1, type=int, help="Jobs preprocessing or estimating poses at once")
+parser.add_argument("--max_training_jobs", dest='max_training_jobs', default=1, type=int, help="Jobs training at once")
+parser.add_argument("--job_retention", dest='job_retention', default=86400, type=int, help="Seconds a finished job and its results are kept")
+parser.add_argument("--max_finished_jobs", dest='max_finished_jobs', default=1000, type=int, help="Finished jobs kept, the oldest are removed first")
+parser.add_argument("--max_queued", dest='max_queued', default=16, type=int, help="Jobs waiting to start before new ones get 429")
+parser.add_argument("--workspace_root", dest='workspace_root', default="./uploaded")
+parser.add_argument("--upload_ttl", dest='upload_ttl', default=86400, type=int, help="Seconds an idle chunked upload is kept")
+parser.add_argument("--cache_dir", dest='cache_dir', default="./cache")
+parser.add_argument("--cache_quota", dest='cache_quota', default=20.0, type=float, help="Result cache size in GB, 0 disables it")
+parser.add_argument("--preprocess_workers", dest='preprocess_workers', default=None, type=int, help="Preprocessing processes, defaults to the number of cores")
+parser.add_argument("--preprocess_in_flight", dest='preprocess_in_flight', default=None, type=int, help="Images decoded at once, defaults to twice the preprocessing processes")
+parser.add_argument("--preprocess_cache_dir", dest='preprocess_cache_dir', default="./preprocess_cache")
+parser.add_argument("--preprocess_cache_quota", dest='preprocess_cache_quota', default=10.0, type=float, help="Preprocessing cache size in GB, 0 disables it")
+parser.add_argument("--min_sharpness", dest='min_sharpness', default=None, type=float, help="Frames with a lower variance of the Laplacian are dropped before pose estimation")
+parser.add_argument("--relative_sharpness", dest='relative_sharpness', default=0.0, type=float, help="Frames below this fraction of the median sharpness are dropped, 0 disables it")
+parser.add_argument("--max_hash_distance", dest='max_hash_distance', default=-1, type=int, help="Frames whose difference hashes differ in at most this many bits are near duplicates, -1 disables it")
+parser.add_argument("--target_frames", dest='target_frames', default=None, type=int, help="Keep at most this many frames for pose estimation")
+parser.add_argument("--keyframe_motion", dest='keyframe_motion', default=0.05, type=float, help="Camera motion between video keyframes as a fraction of the frame diagonal")
+parser.add_argument("--decoded_store", dest='decoded_store', default=1, type=int, help="Keep preprocessed images decoded in the workspace and encode them once before pose estimation, 0 encodes them right after preprocessing")
 GLOBAL = parser.parse_args()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import REGISTRY
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        """
+        :param retry_after: Estimated number of seconds until a new job would be accepted
+        """
+        super().__init__(f'Job queue is full, retry in {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, limits, max_queued, initial_job_seconds=900.0, smoothing=0.2):
+        """
+        :param limits: A dict of stage type to the number of jobs that may run that stage at once, e.g.
+        {'sfm': 2, 'training': 1}
+        :param max_queued: Number of admitted jobs that may wait to start before new ones are rejected
+        :param initial_job_seconds: Job duration assumed for wait estimates until a job finished
+        :param smoothing: Weight of the latest job in the moving average of the job duration
+        """
+        self.limits = dict(limits)
+        self.max_queued = max_queued
+        self.smoothing = smoothing
+        self.job_seconds = initial_job_seconds
+        self._slots = {stage_type: threading.BoundedSemaphore(limit) for stage_type, limit in self.limits.items()}
+        self._waiting = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        """
+        :return: Number of jobs that can make progress at once, bounded by the scarcest stage type
+        """
+        return max(1, min(self.limits.values()))
+
+    def reserve(self):
+        """
+        Reserves a place in the wait queue for a new job
+        :raises QueueFull: when max_queued jobs are already waiting
+        """
+        with self._lock:
+            if self._waiting >= self.max_queued:
+                REGISTRY.inc('admission_rejected_total', description='Jobs rejected because the queue was full')
+                raise QueueFull(self._estimated_wait(self._waiting))
+            self._waiting += 1
+
+    def cancel(self):
+        """
+        Gives back a reservation of a job that will never start
+        """
+        with self._lock:
+            self._waiting -= 1
+
+    def started(self):
+        with self._lock:
+            self._waiting -= 1
+            self._running += 1
+
+    def finished(self, seconds):
+        with self._lock:
+            self._running -= 1
+            self.job_seconds += self.smoothing * (seconds - self.job_seconds)
+
+    def estimated_wait(self):
+        """
+        :return: Estimated number of seconds until a job admitted now would start
+        """
+        with self._lock:
+            return self._estimated_wait(self._waiting)
+
+    def _estimated_wait(self, waiting):
+        busy = waiting + max(0, self._running - self.concurrency + 1)
+        return int(math.ceil(busy * self.job_seconds / self.concurrency))
+
+    @contextmanager
+    def slot(self, stage_type):
+        """
+        Blocks until the stage type has a free slot and holds it for the duration of the block
+        """
+        tic = time.perf_counter()
+        with self._slots[stage_type]:
+            REGISTRY.observe('admission_wait_seconds', time.perf_counter() - tic,
+                             'Time jobs waited for a stage slot', stage_type=stage_type)
+            yield
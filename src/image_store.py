@@ -0,0 +1,86 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+class ImageStore:
+    def __init__(self, root):
+        """
+        Decoded images of a single job, kept as uncompressed .npy files whose header records their shape and dtype.
+        Stages running in Python map them instead of decoding an encoded file again, encoded files are only written
+        once for the external tools that need them, e.g. COLMAP and HLOC
+        :param root: Directory of the store, the decoded folder of the workspace
+        """
+        self.root = os.path.abspath(root)
+        # Created once here, so a worker putting an image after the workspace was removed fails instead of
+        # recreating it
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, f'{name}.npy')
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name))
+
+    def names(self):
+        """
+        :return: The sorted names of the stored images
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(entry[:-4] for entry in os.listdir(self.root)
+                      if entry.endswith('.npy') and not entry.startswith('.'))
+
+    def put(self, name, image):
+        """
+        :param name: File name the image is exported as, e.g. IMG_0001.jpg
+        :return: Number of bytes written
+        """
+        path = self._path(name)
+        tmp = os.path.join(self.root, f'.{name}.{uuid.uuid4().hex}.npy')
+        np.save(tmp, np.ascontiguousarray(image), allow_pickle=False)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def get(self, name):
+        """
+        :return: A read only memory map of the image, or None when it is not stored
+        """
+        try:
+            return np.load(self._path(name), mmap_mode='r', allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def discard(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def export(self, folder, workers=None, names=None):
+        """
+        Encodes the stored images into folder under their name. The source files are removed when their decoded
+        image is stored, so a file of the same name can only be an earlier export and is not encoded again
+        :param workers: Number of threads encoding at once, defaults to the number of cores
+        :param names: Names of the images to encode, defaults to every stored image
+        :return: A list of the paths that were written
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        def encode(name):
+            target = os.path.join(folder, name)
+            if os.path.exists(target):
+                return None
+            # Encoded next to the store and moved in place, so an interrupted export never leaves a partial file
+            tmp = os.path.join(self.root, f'.{uuid.uuid4().hex}.{name}')
+            if not cv2.imwrite(tmp, self.get(name)):
+                raise ValueError(f'Could not encode {target}')
+            os.replace(tmp, target)
+            return target
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            names = self.names() if names is None else names
+            return [target for target in pool.map(encode, names) if target is not None]
@@ -0,0 +1,341 @@
+import hashlib
+import os
+import struct
+import threading
+import zipfile
+import zlib
+
+LOCAL_FILE_HEADER = b'PK\x03\x04'
+CENTRAL_DIRECTORY_HEADERS = (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06')
+DATA_DESCRIPTOR = b'PK\x07\x08'
+LOCAL_FILE_HEADER_SIZE = 30
+CHUNK_SIZE = 1 << 20
+
+
+class UploadClosed(Exception):
+    """
+    Raised for chunks that arrive after their upload was finalized or aborted
+    """
+
+
+def read_header(stream, boundary, chunk_size=CHUNK_SIZE):
+    """
+    Reads the json header that prefixes the zip archive of a /start_nerf request
+    :param stream: The request input stream
+    :param boundary: Length of the json header in bytes
+    :return: A tuple of a memoryview over the header and a memoryview over the bytes read past it
+    """
+    buffer = bytearray()
+    while len(buffer) < boundary:
+        chunk = stream.read(max(chunk_size, boundary - len(buffer)))
+        if not chunk:
+            raise ValueError('Request body is shorter than its boundary')
+        buffer += chunk
+    view = memoryview(buffer)
+    return view[:boundary], view[boundary:]
+
+
+class StreamingZipExtractor:
+    def __init__(self, dest, on_member=None):
+        """
+        Extracts a zip archive incrementally while it is being received, every member is written to disk as soon as
+        its data is complete. Archives that can not be parsed as a stream (encrypted members, unknown compression,
+        stored members with data descriptors) are flagged as unsupported and must be extracted from the spooled copy.
+        :param dest: Directory the members are extracted to
+        :param on_member: Optional callable on_member(path) invoked for every completed file, the sha256 of each file
+        is collected in digests
+        """
+        self.dest = os.path.abspath(dest)
+        self.on_member = on_member
+        self.members = set()
+        self.digests = {}
+        self.supported = True
+        self.finished = False
+        self._buffer = bytearray()
+        self._member = None
+
+    def feed(self, data):
+        if self.finished or not self.supported:
+            return
+        self._buffer += data
+        while self._buffer and not self.finished and self.supported:
+            if self._member is None:
+                if not self._read_local_header():
+                    return
+            elif self._member.descriptor_pending:
+                if not self._read_descriptor():
+                    return
+            else:
+                self._read_data()
+                if self._member is not None and not self._member.descriptor_pending:
+                    return
+
+    def extract_remaining(self, archive):
+        """
+        Extracts the members of the spooled archive that were not streamed already
+        :param archive: Path of the complete zip file
+        """
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.filename in self.members:
+                    continue
+                path = self._target(info.filename)
+                if path is None:
+                    continue
+                zf.extract(info, self.dest)
+                self.members.add(info.filename)
+                if info.is_dir():
+                    continue
+                digest = hashlib.sha256()
+                with zf.open(info) as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                self.digests[path] = digest.hexdigest()
+                if self.on_member is not None:
+                    self.on_member(path)
+
+    def _target(self, name):
+        path = os.path.abspath(os.path.join(self.dest, name))
+        if os.path.commonpath([path, self.dest]) != self.dest:
+            return None
+        return path
+
+    def _read_local_header(self):
+        if len(self._buffer) < 4:
+            return False
+        signature = bytes(self._buffer[:4])
+        if signature in CENTRAL_DIRECTORY_HEADERS:
+            self.finished = True
+            self._buffer.clear()
+            return False
+        if signature != LOCAL_FILE_HEADER:
+            self.supported = False
+            return False
+        if len(self._buffer) < LOCAL_FILE_HEADER_SIZE:
+            return False
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_length,
+         extra_length) = struct.unpack('<IHHHHHIIIHH', self._buffer[:LOCAL_FILE_HEADER_SIZE])
+        header_size = LOCAL_FILE_HEADER_SIZE + name_length + extra_length
+        if len(self._buffer) < header_size:
+            return False
+        name = bytes(self._buffer[LOCAL_FILE_HEADER_SIZE:LOCAL_FILE_HEADER_SIZE + name_length])
+        name = name.decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = bytes(self._buffer[LOCAL_FILE_HEADER_SIZE + name_length:header_size])
+        if compressed_size == 0xFFFFFFFF or size == 0xFFFFFFFF:
+            size, compressed_size = self._zip64_sizes(extra, size, compressed_size)
+        has_descriptor = bool(flags & 0x8)
+        if flags & 0x1 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or \
+                (has_descriptor and method == zipfile.ZIP_STORED):
+            self.supported = False
+            return False
+        del self._buffer[:header_size]
+        self._member = _Member(name, self._target(name), method, crc, None if has_descriptor else compressed_size)
+        return True
+
+    @staticmethod
+    def _zip64_sizes(extra, size, compressed_size):
+        offset = 0
+        while offset + 4 <= len(extra):
+            header_id, data_size = struct.unpack('<HH', extra[offset:offset + 4])
+            if header_id == 0x0001:
+                fields = extra[offset + 4:offset + 4 + data_size]
+                position = 0
+                if size == 0xFFFFFFFF:
+                    size, = struct.unpack('<Q', fields[position:position + 8])
+                    position += 8
+                if compressed_size == 0xFFFFFFFF:
+                    compressed_size, = struct.unpack('<Q', fields[position:position + 8])
+                break
+            offset += 4 + data_size
+        return size, compressed_size
+
+    def _read_data(self):
+        member = self._member
+        if member.remaining is None:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            member.write(data)
+            if member.decompressor.eof:
+                self._buffer[:0] = member.decompressor.unused_data
+                member.descriptor_pending = True
+            return
+        data = bytes(self._buffer[:member.remaining])
+        del self._buffer[:len(data)]
+        member.remaining -= len(data)
+        member.write(data)
+        if member.remaining == 0:
+            self._finish_member()
+
+    def _read_descriptor(self):
+        # The descriptor is 12 bytes, or 20 for zip64, optionally prefixed with a signature. It is always followed by
+        # another header so the next signature tells which layout was used.
+        offset = 4 if self._buffer[:4] == DATA_DESCRIPTOR else 0
+        for size in (offset + 12, offset + 20):
+            if len(self._buffer) < size + 4:
+                return False
+            if bytes(self._buffer[size:size + 2]) == b'PK':
+                self._member.crc, = struct.unpack('<I', self._buffer[offset:offset + 4])
+                del self._buffer[:size]
+                self._finish_member()
+                return True
+        self.supported = False
+        return False
+
+    def _finish_member(self):
+        member = self._member
+        self._member = None
+        member.close()
+        self.members.add(member.name)
+        if member.path is None or member.is_dir:
+            return
+        self.digests[member.path] = member.sha256.hexdigest()
+        if self.on_member is not None:
+            self.on_member(member.path)
+
+
+class _Member:
+    def __init__(self, name, path, method, crc, compressed_size):
+        self.name = name
+        self.path = path
+        self.crc = crc
+        self.remaining = compressed_size
+        self.descriptor_pending = False
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else None
+        self.is_dir = name.endswith('/')
+        self.sha256 = hashlib.sha256()
+        self._crc = 0
+        self._file = None
+        if path is not None:
+            if self.is_dir:
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._file = open(path, 'wb')
+
+    def write(self, data):
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self.sha256.update(data)
+        if self._file is not None:
+            self._file.write(data)
+
+    def close(self):
+        if self.decompressor is not None:
+            self.write(b'')
+        if self._file is not None:
+            self._file.close()
+        if self._crc != self.crc:
+            raise zipfile.BadZipFile(f'Bad CRC-32 for file {self.name}')
+
+
+class ZipIngest:
+    spool_mode = 'wb'
+
+    def __init__(self, workspace, on_member=None):
+        """
+        Spools an uploaded zip archive into the workspace while extracting it on the fly
+        :param workspace: Workspace of the job receiving the upload
+        :param on_member: Optional callable on_member(path) invoked for every extracted file
+        """
+        self.workspace = workspace
+        self.extractor = StreamingZipExtractor(workspace.path, on_member)
+        self._spool = open(workspace.upload, self.spool_mode)
+
+    def feed(self, data):
+        self._spool.write(data)
+        self.extractor.feed(data)
+
+    def consume(self, stream, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+
+    def abort(self):
+        """
+        Stops receiving the archive without extracting the rest of it
+        """
+        self._spool.close()
+
+    def close(self):
+        self._spool.close()
+        if not self.extractor.finished and zipfile.is_zipfile(self.workspace.upload):
+            self.extractor.extract_remaining(self.workspace.upload)
+
+
+class ChunkedZipIngest(ZipIngest):
+    spool_mode = 'w+b'
+
+    def __init__(self, workspace, size, on_member=None):
+        """
+        Receives a zip archive as chunks that may arrive out of order or more than once, members are extracted as
+        soon as every chunk before them has arrived
+        :param size: Total size of the archive in bytes
+        """
+        super().__init__(workspace, on_member)
+        self.size = size
+        self.ranges = []
+        self.contiguous = 0
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.contiguous == self.size
+
+    def missing(self):
+        """
+        :return: A list of [start, end) byte ranges that were not received yet
+        """
+        with self._lock:
+            gaps = []
+            position = 0
+            for start, end in self.ranges:
+                if start > position:
+                    gaps.append([position, start])
+                position = end
+            if position < self.size:
+                gaps.append([position, self.size])
+            return gaps
+
+    def write(self, offset, data):
+        """
+        :raises ValueError: for chunks outside of the archive
+        :raises UploadClosed: when the upload was finalized or aborted
+        """
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(f'Chunk [{offset}, {offset + len(data)}) is outside of the upload of size {self.size}')
+        with self._lock:
+            if self._spool.closed:
+                raise UploadClosed('Upload is already finalized or aborted')
+            self._spool.seek(offset)
+            self._spool.write(data)
+            self._add_range(offset, offset + len(data))
+            contiguous = self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+            position = self.contiguous
+            while position < contiguous:
+                self._spool.seek(position)
+                chunk = self._spool.read(min(CHUNK_SIZE, contiguous - position))
+                self.extractor.feed(chunk)
+                position += len(chunk)
+            self.contiguous = contiguous
+
+    def abort(self):
+        # Waits for a chunk that is still being written
+        with self._lock:
+            super().abort()
+
+    def close(self):
+        with self._lock:
+            super().close()
+
+    def _add_range(self, start, end):
+        merged = []
+        for r in self.ranges:
+            if r[1] < start or r[0] > end:
+                merged.append(r)
+            else:
+                start, end = min(start, r[0]), max(end, r[1])
+        merged.append([start, end])
+        self.ranges = sorted(merged)
@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from .workspace import Workspace
+from .metrics import REGISTRY
+
+
+class JobStatus:
+    UPLOADING = 'uploading'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, root, preprocessing, estimator, model='nerf', time_slice='', frame_selection=None):
+        """
+        :param root: Directory under which the workspace of the job is created
+        :param preprocessing: Names of the preprocessing wizards to run
+        :param estimator: Name of the pose estimator
+        :param model: Reconstruction model
+        :param time_slice: "t1,t2" in seconds to only select keyframes of videos between t1 and t2
+        :param frame_selection: Optional parameters of the frame selection that replace the server defaults
+        """
+        self.id = uuid.uuid4().hex
+        self.workspace = Workspace.for_job(root, self.id)
+        self.preprocessing = preprocessing
+        self.estimator = estimator
+        self.model = model
+        self.time_slice = time_slice
+        self.frame_selection = frame_selection
+        self.preprocessed = False
+        # Futures of the images submitted for preprocessing while they were ingested
+        self.pending = []
+        self.cache_key = None
+        self.status = JobStatus.QUEUED
+        self.stage = None
+        self.artifacts = {}
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def report(self, event, **data):
+        if event == 'stage':
+            self.stage = data['stage']
+
+    def to_dict(self):
+        return {'id': self.id,
+                'status': self.status,
+                'stage': self.stage,
+                'estimator': self.estimator,
+                'preprocessing': self.preprocessing,
+                'model': self.model,
+                'time_slice': self.time_slice,
+                'frame_selection': self.frame_selection,
+                'artifacts': sorted(self.artifacts),
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished}
+
+
+class JobQueue:
+    def __init__(self, run, workers=1, bus=None, admission=None, retention=None, max_finished=None):
+        """
+        :param run: Callable run(job, progress) that executes a job, returns a dict of artifact name to path
+        :param workers: Number of background worker threads
+        :param bus: Optional ProgressBus the events and status changes of the jobs are published to
+        :param admission: Optional AdmissionController whose reservations are handed over when a job starts
+        :param retention: Seconds a finished job and its results are kept, None keeps them forever
+        :param max_finished: Number of finished jobs kept, the oldest ones are removed first
+        """
+        self._run = run
+        self.retention = retention
+        self.max_finished = max_finished
+        self._bus = bus
+        self._admission = admission
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def register(self, job: Job):
+        """
+        Makes a job whose images are still being uploaded visible, so its status and events can be followed before
+        it is submitted
+        """
+        with self._lock:
+            self._jobs[job.id] = job
+        self._set_status(job, JobStatus.UPLOADING)
+        return job
+
+    def submit(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+        self._set_status(job, JobStatus.QUEUED)
+        self._queue.put(job)
+        return job
+
+    def fail(self, job: Job, error):
+        """
+        Marks a job that never reached the queue as failed, e.g. because its upload was aborted
+        """
+        job.error = error
+        job.finished = time.time()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._set_status(job, JobStatus.FAILED)
+
+    def add(self, job: Job, artifacts):
+        """
+        Registers a job whose artifacts are already available in its results folder without running it
+        """
+        job.artifacts = artifacts
+        job.started = job.finished = time.time()
+        job.workspace.clean(keep_results=True)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._set_status(job, JobStatus.SUCCEEDED)
+        return job
+
+    def reporter(self, job: Job):
+        """
+        :return: A callable progress(event, **data) that records the events of the job and publishes them
+        """
+        def progress(event, **data):
+            job.report(event, **data)
+            if self._bus is not None:
+                self._bus.publish(job.id, event, **data)
+        return progress
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job):
+        """
+        :return: Number of queued jobs submitted before the given one
+        """
+        with self._lock:
+            return sum(1 for j in self._jobs.values()
+                       if j.status == JobStatus.QUEUED and j.created < job.created)
+
+    def _set_status(self, job: Job, status):
+        job.status = status
+        if status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+            REGISTRY.inc('jobs_total', description='Number of finished jobs', status=status)
+            REGISTRY.observe('job_seconds', job.finished - job.created, 'Time from submission to completion of a job',
+                             status=status)
+            self._prune()
+        if self._bus is None:
+            return
+        self._bus.publish(job.id, 'status', status=status, error=job.error)
+        if status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+            self._bus.close(job.id)
+
+    def _prune(self):
+        # Forgets finished jobs past their retention or beyond max_finished and removes their workspace
+        now = time.time()
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values()
+                               if j.status in (JobStatus.SUCCEEDED, JobStatus.FAILED) and j.finished is not None),
+                              key=lambda j: j.finished)
+            expired = [j for j in finished if self.retention is not None and now - j.finished > self.retention]
+            if self.max_finished is not None and len(finished) - len(expired) > self.max_finished:
+                expired = finished[:len(finished) - self.max_finished]
+            for j in expired:
+                del self._jobs[j.id]
+        for j in expired:
+            j.workspace.clean(keep_results=False)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started = time.time()
+            if self._admission is not None:
+                self._admission.started()
+            self._set_status(job, JobStatus.RUNNING)
+            try:
+                job.artifacts = self._run(job, self.reporter(job)) or {}
+                status = JobStatus.SUCCEEDED
+            except (Exception, SystemExit) as e:
+                # do_system exits on failed commands, that must not take the worker thread down
+                traceback.print_exc()
+                job.error = str(e) or type(e).__name__
+                status = JobStatus.FAILED
+            finally:
+                job.finished = time.time()
+                job.workspace.clean(keep_results=True)
+                if self._admission is not None:
+                    self._admission.finished(job.finished - job.started)
+            self._set_status(job, status)
+            self._queue.task_done()
@@ -0,0 +1,112 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+                   1800.0, 3600.0)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    def __init__(self, prefix='reconstruction'):
+        """
+        Thread safe store of counters and histograms rendered in the Prometheus text exposition format
+        :param prefix: Prepended to the name of every metric
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, labels, factory, description):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = factory()
+                self._help.setdefault(name, (kind, description))
+            return metric
+
+    def inc(self, name, amount=1.0, description='', **labels):
+        counter = self._get('counter', name, labels, Counter, description)
+        with self._lock:
+            counter.inc(amount)
+
+    def observe(self, name, value, description='', **labels):
+        histogram = self._get('histogram', name, labels, Histogram, description)
+        with self._lock:
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, name, description='', **labels):
+        """
+        Records the duration of the block in the <name>_seconds histogram and counts failures in <name>_errors_total
+        """
+        tic = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f'{name}_errors_total', description=f'Failures of {name}', **labels)
+            raise
+        finally:
+            self.observe(f'{name}_seconds', time.perf_counter() - tic, description=description, **labels)
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                kind, description = self._help[name]
+                full_name = f'{self.prefix}_{name}'
+                if description:
+                    lines.append(f'# HELP {full_name} {description}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for (metric_name, labels), metric in sorted(self._metrics.items()):
+                    if metric_name != name:
+                        continue
+                    if kind == 'counter':
+                        lines.append(f'{full_name}{_labels(labels)} {metric.value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets, metric.counts):
+                        cumulative += count
+                        lines.append(f'{full_name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+                    lines.append(f'{full_name}_bucket{_labels(labels + (("le", "+Inf"),))} {metric.count}')
+                    lines.append(f'{full_name}_sum{_labels(labels)} {metric.sum}')
+                    lines.append(f'{full_name}_count{_labels(labels)} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+REGISTRY = MetricsRegistry()
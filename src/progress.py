@@ -0,0 +1,103 @@
+import collections
+import json
+import threading
+import time
+
+# Events that may be published at a high rate, they are dropped when they arrive faster than min_interval
+THROTTLED_EVENTS = ('training', 'preprocessing')
+
+
+class ProgressBus:
+    def __init__(self, history=512, min_interval=0.5, keepalive=15.0, retention=300.0):
+        """
+        Fans progress events of running jobs out to any number of subscribers
+        :param history: Number of events kept per job so late subscribers can replay them
+        :param min_interval: Minimum number of seconds between two throttled events of the same job
+        :param keepalive: Seconds after which an idle stream sends a comment to keep the connection open
+        :param retention: Seconds the events of a finished job are kept for late subscribers
+        """
+        self.history = history
+        self.min_interval = min_interval
+        self.keepalive = keepalive
+        self.retention = retention
+        self._channels = {}
+        self._condition = threading.Condition()
+
+    def publish(self, job_id, event, **data):
+        now = time.monotonic()
+        with self._condition:
+            channel = self._channels.setdefault(job_id, _Channel(self.history))
+            if event in THROTTLED_EVENTS and not data.get('final'):
+                if now - channel.last_published.get(event, float('-inf')) < self.min_interval:
+                    return
+            channel.last_published[event] = now
+            channel.last_id += 1
+            channel.events.append((channel.last_id, event, data))
+            self._condition.notify_all()
+
+    def close(self, job_id):
+        """
+        Marks the job as finished, its subscribers stop once they received every event
+        """
+        now = time.monotonic()
+        with self._condition:
+            channel = self._channels.setdefault(job_id, _Channel(self.history))
+            channel.closed = True
+            channel.closed_at = now
+            # Subscribers hold on to their channel, dropping it only stops late subscribers from replaying it
+            expired = [key for key, c in self._channels.items() if c.closed and now - c.closed_at > self.retention]
+            for key in expired:
+                del self._channels[key]
+            self._condition.notify_all()
+
+    def subscribe(self, job_id, last_id=0, finished=False):
+        """
+        :param last_id: Id of the last event the subscriber already received
+        :param finished: The job already finished, so the stream ends right away once its events were dropped
+        :return: A generator of (id, event, data) tuples, None is yielded whenever keepalive elapsed without events
+        """
+        channel = None
+        while True:
+            with self._condition:
+                if channel is None:
+                    channel = self._channels.get(job_id)
+                    if channel is None and not finished:
+                        # Nothing was published yet, waiting must not create a channel nobody ever closes
+                        self._condition.wait(self.keepalive)
+                        channel = self._channels.get(job_id)
+                if channel is None:
+                    pending, closed = [], finished
+                else:
+                    pending = [e for e in channel.events if e[0] > last_id]
+                    if not pending and not channel.closed:
+                        self._condition.wait(self.keepalive)
+                        pending = [e for e in channel.events if e[0] > last_id]
+                    closed = channel.closed
+            if not pending:
+                if closed:
+                    return
+                yield None
+                continue
+            for e in pending:
+                last_id = e[0]
+                yield e
+
+    def stream(self, job_id, last_id=0, finished=False):
+        """
+        :return: A generator of the job events formatted as Server-Sent Events
+        """
+        for e in self.subscribe(job_id, last_id, finished):
+            if e is None:
+                yield ': keepalive\n\n'
+                continue
+            event_id, event, data = e
+            yield f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+class _Channel:
+    def __init__(self, history):
+        self.events = collections.deque(maxlen=history)
+        self.last_id = 0
+        self.last_published = {}
+        self.closed = False
+        self.closed_at = None
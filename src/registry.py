@@ -0,0 +1,35 @@
+import threading
+
+
+class LazyRegistry:
+    def __init__(self, factories):
+        """
+        Maps names to objects that are only created the first time they are looked up, so heavy dependencies are
+        imported on first use instead of at startup
+        :param factories: A dict of name to a callable without arguments that creates the object
+        """
+        self._factories = dict(factories)
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
+    def loaded(self):
+        """
+        :return: The names whose objects were already created
+        """
+        with self._lock:
+            return list(self._instances)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+class ResultCache:
+    def __init__(self, root, quota_bytes):
+        """
+        Content addressed store of reconstruction artifacts, least recently used entries are evicted once the
+        cache grows past its quota
+        :param root: Directory holding one folder per cached reconstruction
+        :param quota_bytes: Maximum size of the cache on disk, 0 disables caching
+        """
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(image_digests, pipeline, estimator, ngp_options, frame_selection=None):
+        """
+        :param image_digests: sha256 digests of the input images, their order is irrelevant
+        :param pipeline: The list of PPWizards run on the images
+        :param estimator: Name of the pose estimator
+        :param ngp_options: A dict of the InstantNGPPredictOptions that change the trained model
+        :param frame_selection: A dict of the parameters that decide which frames and video keyframes are used
+        """
+        description = json.dumps({'images': sorted(image_digests),
+                                  'pipeline': [wizard.fingerprint() for wizard in pipeline],
+                                  'estimator': estimator,
+                                  'ngp': ngp_options,
+                                  'frame_selection': frame_selection}, sort_keys=True, default=repr)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def get(self, key, folder):
+        """
+        Hard links the cached artifacts into folder, or copies them where links are not supported, so they stay
+        available when the entry is evicted
+        :param folder: Directory the artifacts are placed in, e.g. the results folder of the job
+        :return: A dict of artifact name to path in folder, or None on a miss
+        """
+        if not self.quota_bytes:
+            return None
+        entry = os.path.join(self.root, key)
+        artifacts = {}
+        with self._lock:
+            manifest = self._read_manifest(entry)
+            if manifest is None:
+                return None
+            manifest['last_used'] = time.time()
+            self._write_manifest(entry, manifest)
+            os.makedirs(folder, exist_ok=True)
+            for name, file in manifest['artifacts'].items():
+                source, target = os.path.join(entry, file), os.path.join(folder, file)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copyfile(source, target)
+                artifacts[name] = target
+        return artifacts
+
+    def put(self, key, artifacts):
+        """
+        Copies the artifacts of a finished reconstruction into the cache
+        :param artifacts: A dict of artifact name to path
+        """
+        if not self.quota_bytes:
+            return
+        entry = os.path.join(self.root, key)
+        staging = os.path.join(self.root, f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(staging)
+        manifest = {'artifacts': {}, 'size': 0, 'last_used': time.time()}
+        for name, path in artifacts.items():
+            file = os.path.basename(path)
+            shutil.copyfile(path, os.path.join(staging, file))
+            manifest['artifacts'][name] = file
+            manifest['size'] += os.path.getsize(path)
+        self._write_manifest(staging, manifest)
+        with self._lock:
+            if os.path.isdir(entry):
+                shutil.rmtree(staging, ignore_errors=True)
+                return
+            os.rename(staging, entry)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            if key.startswith('.'):
+                continue
+            manifest = self._read_manifest(os.path.join(self.root, key))
+            if manifest is None:
+                continue
+            entries.append((manifest['last_used'], manifest['size'], key))
+            total += manifest['size']
+        for last_used, size, key in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
+
+    @staticmethod
+    def _read_manifest(entry):
+        try:
+            with open(os.path.join(entry, 'manifest.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_manifest(entry, manifest):
+        tmp = os.path.join(entry, 'manifest.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(entry, 'manifest.json'))
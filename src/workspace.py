@@ -0,0 +1,73 @@
+import os
+import shutil
+
+
+class Workspace:
+    def __init__(self, path):
+        """
+        :param path: Root directory of the workspace, every artifact of a reconstruction is resolved inside it
+        """
+        self.path = os.path.abspath(path)
+
+    @staticmethod
+    def for_job(root, job_id):
+        return Workspace(os.path.join(root, job_id))
+
+    @property
+    def images(self):
+        return os.path.join(self.path, 'images')
+
+    @property
+    def decoded(self):
+        return os.path.join(self.path, 'decoded')
+
+    @property
+    def upload(self):
+        return os.path.join(self.path, 'temp.zip')
+
+    @property
+    def culled(self):
+        return os.path.join(self.path, 'culled')
+
+    @property
+    def failed(self):
+        return os.path.join(self.path, 'failed')
+
+    @property
+    def transforms(self):
+        return os.path.join(self.path, 'transforms.json')
+
+    @property
+    def results(self):
+        return os.path.join(self.path, 'results')
+
+    @property
+    def snapshot(self):
+        return os.path.join(self.results, 'nerfsnapshot.ingp')
+
+    @property
+    def mesh(self):
+        return os.path.join(self.results, 'nerfmesh.obj')
+
+    def create(self):
+        os.makedirs(self.path)
+        return self
+
+    def clean(self, keep_results=True):
+        """
+        Removes the intermediate files of the workspace
+        :param keep_results: keep the results folder so its artifacts can still be served
+        """
+        if not keep_results:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if entry == self.results:
+                continue
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                os.remove(entry)
@@ -1,14 +1,193 @@
+import hashlib
 import json.decoder
-import shutil
+import threading
 
-from flask import Blueprint, render_template, request, redirect, make_response, send_from_directory, send_file
+from flask import Blueprint, render_template, request, redirect, make_response, send_from_directory, send_file, \
+    jsonify, abort, Response, stream_with_context
 from logic import *
-
-import zipfile
+from src.jobs import Job, JobQueue, JobStatus
+from src.ingest import ZipIngest, ChunkedZipIngest, UploadClosed, read_header
+from src.result_cache import ResultCache
+from src.progress import ProgressBus
+from src.metrics import REGISTRY
+from src.admission import AdmissionController, QueueFull
 
 core_bp = Blueprint("core", __name__)
 
 
+def run_job(job: Job, progress):
+    artifacts = reconstruct(job.workspace.path, job.preprocessing, job.model, job.estimator, progress=progress,
+                            preprocess=not job.preprocessed, admission=admission, pending=job.pending,
+                            time_slice=job.time_slice, frame_selection=job.frame_selection)
+    if job.cache_key is not None and artifacts:
+        result_cache.put(job.cache_key, artifacts)
+    return artifacts
+
+
+progress_bus = ProgressBus()
+admission = AdmissionController({'sfm': GLOBAL.max_sfm_jobs, 'training': GLOBAL.max_training_jobs},
+                                max_queued=GLOBAL.max_queued)
+jobs = JobQueue(run_job, workers=GLOBAL.workers or sum(admission.limits.values()), bus=progress_bus,
+                admission=admission, retention=GLOBAL.job_retention, max_finished=GLOBAL.max_finished_jobs)
+result_cache = ResultCache(GLOBAL.cache_dir, int(GLOBAL.cache_quota * 1024 ** 3))
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+
+
+class IngestSession:
+    def __init__(self, job: Job, upload_type=ZipIngest, **upload_args):
+        """
+        Extracts the uploaded zip into the job workspace while it arrives, images are preprocessed as soon as they are
+        extracted so decoding overlaps with the rest of the upload. Extraction waits while the preprocessor has too many
+        images in flight, which slows down reading the upload instead of piling up decoded images. Videos are left in
+        the workspace, their keyframes are extracted by the job
+        :param upload_type: ZipIngest for a single streamed body, ChunkedZipIngest for resumable uploads
+        """
+        self.job = job
+        self.pipeline = build_pipeline(job.preprocessing)
+        self.store = image_store(job.workspace)
+        jobs.register(job)
+        self.progress = jobs.reporter(job)
+        self.progress('stage', stage='upload')
+        self.last_activity = time.time()
+        self._pending = []
+        self._done = []
+        self.upload = upload_type(job.workspace, on_member=self._on_member, **upload_args)
+
+    def _on_done(self, future):
+        self._done.append(future)
+        self.progress('preprocessing', done=len(self._done), total=len(self._pending))
+
+    def _track(self, future):
+        self._pending.append(future)
+        future.add_done_callback(self._on_done)
+
+    def _on_member(self, path):
+        if os.path.dirname(path) != self.job.workspace.images:
+            return
+        if is_video(path):
+            # Keyframes are picked by the job once it holds an admission slot
+            return
+        self._track(preprocessor.submit(path, self.pipeline, store=self.store))
+
+    def close(self):
+        """
+        Extracts whatever could not be streamed and computes the result cache key. The preprocessing is not waited
+        for, the job does that while holding its admission slot
+        """
+        workspace = self.job.workspace
+        self.upload.close()
+        self.job.preprocessed = True
+        self.job.pending = self._pending
+        image_digests = [digest for path, digest in self.upload.extractor.digests.items()
+                         if os.path.dirname(path) == workspace.images]
+        frame_selection = {'frames': vars(job_frame_selector(self.job.frame_selection)),
+                           'keyframes': {**vars(keyframe_extractor), 'time_slice': self.job.time_slice}}
+        self.job.cache_key = ResultCache.key(image_digests, self.pipeline, self.job.estimator,
+                                             ngp_options(workspace).training_params(), frame_selection)
+
+    def cancel(self):
+        """
+        Stops the preprocessing of the images that did not start yet
+        """
+        for future in self._pending:
+            future.cancel()
+
+    def abort(self):
+        self.upload.abort()
+        self.cancel()
+        admission.cancel()
+        self.job.workspace.clean(keep_results=False)
+        jobs.fail(self.job, 'Upload aborted')
+
+
+def ingest(job: Job, stream, received=b''):
+    """
+    :param received: Bytes of the archive that were already read from the stream
+    """
+    session = IngestSession(job)
+    try:
+        session.upload.feed(received)
+        session.upload.consume(stream)
+        session.close()
+    except Exception:
+        session.cancel()
+        raise
+
+
+def submit(job: Job):
+    """
+    Queues a job that holds an admission reservation, or completes it right away with a copy of the cached results
+    when the same reconstruction is already cached
+    """
+    cached = result_cache.get(job.cache_key, job.workspace.results) if job.model == 'nerf' else None
+    if cached is not None:
+        REGISTRY.inc('result_cache_total', description='Result cache lookups', result='hit')
+        for future in job.pending:
+            future.cancel()
+        jobs.add(job, cached)
+        # Given back last, so a failure before it leaves the reservation to the caller
+        admission.cancel()
+        return job
+    REGISTRY.inc('result_cache_total', description='Result cache lookups', result='miss')
+    return jobs.submit(job)
+
+
+def valid_size(size):
+    # bools are ints and floats would be truncated
+    if isinstance(size, (bool, float)):
+        return False
+    try:
+        return int(size) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def valid_pipeline(preprocessing):
+    try:
+        build_pipeline(preprocessing)
+    except ValueError:
+        return False
+    return True
+
+
+def valid_frame_selection(options):
+    try:
+        job_frame_selector(options)
+    except ValueError:
+        return False
+    return True
+
+
+def valid_job(payload, *keys):
+    """
+    :param keys: Keys the request needs besides preprocessing, estimator and model, time_slice and
+    frame_selection are optional
+    :return: Whether payload describes a job that can be run, checked before an admission reservation is taken
+    """
+    return isinstance(payload, dict) and {'preprocessing', 'estimator', 'model', *keys} <= payload.keys() and \
+        isinstance(payload['estimator'], str) and payload['estimator'] in poseEstimators and \
+        isinstance(payload['model'], str) and payload['model'] in models and \
+        valid_time_slice(payload.get('time_slice', '')) and valid_frame_selection(payload.get('frame_selection')) and \
+        valid_pipeline(payload['preprocessing'])
+
+
+def fail_submission(job: Job, e: Exception):
+    """
+    Gives back the admission reservation of a job that could not be submitted and fails it
+    """
+    admission.cancel()
+    job.workspace.clean(keep_results=False)
+    jobs.fail(job, str(e) or type(e).__name__)
+
+
+def queue_full(e: QueueFull):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
 @core_bp.route("/")
 def home():
     return send_from_directory('./src/static', 'index.html')
@@ -19,51 +198,189 @@ def debug():
 
 @core_bp.route("/start_nerf", methods=["POST"])
 def start_nerf():
+    # Queue Instant ngp with the given estimatior
+    if 'boundary' not in request.headers:
+        return make_response('', 400)
+    try:
+        header, received = read_header(request.stream, int(request.headers.get('boundary')))
+    except ValueError:
+        header = None
+    json = bytes_to_json_dict(header) if header is not None else None
+    if not valid_job(json):
+        return make_response('', 400)
+    # Abandoned resumable uploads give back their reservations first
+    expire_uploads()
+    # Reject before the images are read when too many jobs are waiting
+    try:
+        admission.reserve()
+    except QueueFull as e:
+        return queue_full(e)
+    job = Job(GLOBAL.workspace_root, json['preprocessing'], json["estimator"], json['model'],
+              json.get('time_slice', ''), json.get('frame_selection'))
     try:
-        # Start Instant ngp with the given estimatior
-        if 'boundary' not in request.headers:
-            return make_response(400)
-        boundary = request.headers.get('boundary')
-        json = bytes_to_json_dict(request.data[0: int(boundary)])
-        pose_estimator = json["estimator"]
-        preprocessing_methods = json['preprocessing']
-        model = json['model']
-        if not os.path.isdir('./uploaded'):
-            os.mkdir('./uploaded')
-        images = request.data[int(boundary):]
-        with open('./uploaded/temp.zip', 'wb') as f:
-            f.write(images)
-            f.close()
-        if zipfile.is_zipfile("./uploaded/temp.zip"):
-            zipfile.ZipFile("./uploaded/temp.zip").extractall("./uploaded")
-        reconstruct('./uploaded', preprocessing_methods, 'nerf', pose_estimator)
+        job.workspace.create()
+        ingest(job, request.stream, received)
+        submit(job)
     except Exception as e:
-        shutil.rmtree('./uploaded')
-        return make_response(500)
-    finally:
-        shutil.rmtree('./uploaded')
-    return send_file('./results/nerfsnapshot.ingp', as_attachment=True)
+        fail_submission(job, e)
+        return make_response('', 500)
+    return jsonify(job.to_dict()), 202
 
 @core_bp.route("/start_nerf_debug", methods=["POST"])
 def start_nerf_debug():
+    # Queue Instant ngp with the given estimatior
+    pose_estimator = request.form.get("estimator")
+    preprocessing_methods = []
+    for i in request.form.getlist('preprocessing'):
+        preprocessing_methods.append(i)
+    payload = {'preprocessing': preprocessing_methods, 'estimator': pose_estimator, 'model': 'nerf',
+               'time_slice': request.form.get('time_slice', '')}
+    if 'images' not in request.files or not valid_job(payload):
+        return make_response('', 400)
+    expire_uploads()
     try:
-        # Start Instant ngp with the given estimatior
-        pose_estimator = request.form["estimator"]
-        preprocessing_methods = []
-        for i in request.form.getlist('preprocessing'):
-            preprocessing_methods.append(i)
-        if not os.path.isdir('./uploaded'):
-            os.mkdir('./uploaded')
-        images = request.files['images']
-        images.save('./uploaded/temp.zip')
-        if zipfile.is_zipfile("./uploaded/temp.zip"):
-            zipfile.ZipFile("./uploaded/temp.zip").extractall("./uploaded")
-        reconstruct('./uploaded', preprocessing_methods, 'nerf', pose_estimator)
+        admission.reserve()
+    except QueueFull as e:
+        return queue_full(e)
+    job = Job(GLOBAL.workspace_root, preprocessing_methods, pose_estimator, time_slice=payload['time_slice'])
+    try:
+        job.workspace.create()
+        ingest(job, request.files['images'].stream)
+        submit(job)
     except Exception as e:
-        shutil.rmtree('./uploaded')
-        return make_response(500)
-    finally:
-        shutil.rmtree('./uploaded')
+        fail_submission(job, e)
+        return make_response('', 500)
     return redirect('/', 302)
 
+def expire_uploads():
+    now = time.time()
+    with upload_sessions_lock:
+        expired = [upload_id for upload_id, session in upload_sessions.items()
+                   if now - session.last_activity > GLOBAL.upload_ttl]
+        expired = [upload_sessions.pop(upload_id) for upload_id in expired]
+    for session in expired:
+        session.abort()
+
+
+def upload_status(session: IngestSession):
+    upload = session.upload
+    return {'id': session.job.id,
+            'size': upload.size,
+            'received': upload.ranges,
+            'next_offset': upload.contiguous,
+            'missing': upload.missing()}
+
+
+def get_upload(upload_id):
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    if session is None:
+        abort(404)
+    session.last_activity = time.time()
+    return session
+
+@core_bp.route("/uploads", methods=["POST"])
+def open_upload():
+    # Opens a resumable upload, the archive is then sent with PUT /uploads/<id>?offset=<n>
+    expire_uploads()
+    json = request.get_json(silent=True)
+    if not valid_job(json, 'size') or not valid_size(json['size']):
+        return make_response('', 400)
+    try:
+        admission.reserve()
+    except QueueFull as e:
+        return queue_full(e)
+    job = Job(GLOBAL.workspace_root, json['preprocessing'], json["estimator"], json['model'],
+              json.get('time_slice', ''), json.get('frame_selection'))
+    try:
+        job.workspace.create()
+        session = IngestSession(job, ChunkedZipIngest, size=int(json['size']))
+    except Exception as e:
+        fail_submission(job, e)
+        return make_response('', 500)
+    with upload_sessions_lock:
+        upload_sessions[job.id] = session
+    return jsonify(upload_status(session)), 201
+
+@core_bp.route("/uploads/<upload_id>", methods=["GET"])
+def upload_progress(upload_id):
+    return jsonify(upload_status(get_upload(upload_id)))
+
+@core_bp.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    # The chunk is the request body, its sha256 must be sent in the X-Chunk-SHA256 header
+    session = get_upload(upload_id)
+    offset = request.args.get('offset', type=int)
+    checksum = request.headers.get('X-Chunk-SHA256')
+    if offset is None or checksum is None:
+        return make_response('', 400)
+    data = request.get_data(cache=False)
+    if hashlib.sha256(data).hexdigest() != checksum.lower():
+        return jsonify({'error': 'checksum mismatch', **upload_status(session)}), 400
+    try:
+        session.upload.write(offset, data)
+    except ValueError as e:
+        return jsonify({'error': str(e), **upload_status(session)}), 416
+    except UploadClosed as e:
+        return jsonify({'error': str(e), **upload_status(session)}), 409
+    return jsonify(upload_status(session))
+
+@core_bp.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    session = get_upload(upload_id)
+    if not session.upload.complete:
+        return jsonify({'error': 'upload is incomplete', **upload_status(session)}), 409
+    with upload_sessions_lock:
+        if upload_sessions.pop(upload_id, None) is None:
+            abort(404)
+    try:
+        session.close()
+        job = submit(session.job)
+    except Exception as e:
+        session.cancel()
+        fail_submission(session.job, e)
+        return make_response('', 500)
+    return jsonify(job.to_dict()), 202
+
+@core_bp.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    with upload_sessions_lock:
+        session = upload_sessions.pop(upload_id, None)
+    if session is None:
+        abort(404)
+    session.abort()
+    return make_response('', 204)
+
+@core_bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    status = job.to_dict()
+    status['position'] = jobs.position(job)
+    return jsonify(status)
+
+@core_bp.route("/jobs/<job_id>/artifacts/<name>")
+def job_artifact(job_id, name):
+    job = jobs.get(job_id)
+    if job is None or name not in job.artifacts:
+        abort(404)
+    return send_file(job.artifacts[name], as_attachment=True)
+
+@core_bp.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        # Malformed ids replay the whole history
+        last_id = 0
+    finished = job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+    return Response(stream_with_context(progress_bus.stream(job_id, last_id, finished)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
+@core_bp.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')